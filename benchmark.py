@@ -0,0 +1,98 @@
+"""
+This module contains performance benchmarks for the pipeline scripts.
+"""
+
+import argparse
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+
+def time_command(args, repeat):
+    durations = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def action_startup(modules, repeat):
+    """
+    Measure how long a fresh interpreter takes to import each module, net
+    of the interpreter's own startup time.
+    """
+    baseline = statistics.median(time_command([sys.executable, "-c", "pass"], repeat))
+    print("%-12s %12s %12s" % ("module", "median (ms)", "min (ms)"))
+    print("%-12s %12.1f" % ("(python)", 1000 * baseline))
+    for module in modules:
+        durations = time_command([sys.executable, "-c", "import " + module], repeat)
+        print("%-12s %12.1f %12.1f" % (
+            module,
+            1000 * (statistics.median(durations) - baseline),
+            1000 * (min(durations) - baseline)
+        ))
+
+
+def random_filters(catalogue, rng):
+    """Draw a query combining a few filters, with values that exist in the catalogue."""
+    filters = dict()
+    for field in ["cast", "directors", "descriptors"]:
+        if catalogue.postings[field] and rng.random() < .3:
+            filters[field] = [rng.choice(list(catalogue.postings[field]))]
+    if catalogue.facets and rng.random() < .3:
+        filters["facets"] = [rng.choice(list(catalogue.facets))]
+    if rng.random() < .5:
+        filters["date_min"] = rng.choice(catalogue.ranges["date"].keys)
+    if rng.random() < .5:
+        filters["duration_max"] = rng.randint(20, 90)
+    if rng.random() < .2:
+        filters["title"] = rng.choice(["la", "mort", "nuit"])
+    return filters
+
+
+def action_query(path_merger, count):
+    """
+    Measure the throughput of the query module on random queries, without
+    the loading time of the catalogue.
+    """
+    import query
+    start = time.perf_counter()
+    catalogue = query.Catalogue.load(path_merger)
+    logging.info("Loaded %d entries in %.2fs", len(catalogue.entries), time.perf_counter() - start)
+    rng = random.Random(0)
+    queries = [random_filters(catalogue, rng) for _ in range(count)]
+    start = time.perf_counter()
+    matches = 0
+    for filters in queries:
+        matches += len(catalogue.query(filters))
+    duration = time.perf_counter() - start
+    print("%d queries in %.3fs: %.0f queries/s, %.1f matches/query" % (
+        count,
+        duration,
+        count / duration,
+        matches / count
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--modules", type=str, nargs="+", default=["tags", "merge", "search", "tfidf"])
+    parser.add_argument("--merger", type=str, default="data/merger.json")
+    parser.add_argument("--queries", type=int, default=10000)
+    parser.add_argument("action", choices=["startup", "query"])
+    args = parser.parse_args()
+    if args.action == "startup":
+        action_startup(args.modules, args.repeat)
+    elif args.action == "query":
+        action_query(args.merger, args.queries)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
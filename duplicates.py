@@ -0,0 +1,163 @@
+"""
+This module looks for YouTube videos that are uploads of the same episode,
+by comparing what is said in them rather than their titles. Every caption
+text is summarized by a MinHash signature of its word shingles, and
+locality-sensitive hashing of the signature bands only brings together
+videos likely to be near-duplicates, which avoids comparing every video
+against every other.
+"""
+
+import argparse
+import codecs
+import itertools
+import logging
+import os
+import re
+import zlib
+import numpy
+import simplejson
+import tqdm
+
+
+# Permutations are (a * x + b) mod HASH_PRIME, with x a CRC32 shingle hash.
+# HASH_PRIME is the smallest prime above 2**32, hence above every x; as a, b
+# and x are below 2**32, a * x + b is below 2**64 and never wraps in uint64.
+HASH_PRIME = 4294967311
+
+
+def shingle_hashes(text, size):
+    """Hash the shingles of a text, none if it is shorter than one shingle."""
+    words = re.findall(r"\w+", text.lower())
+    shingles = set(
+        " ".join(words[i:i + size])
+        for i in range(len(words) - size + 1)
+    )
+    return numpy.array([zlib.crc32(shingle.encode("utf8")) for shingle in shingles], dtype=numpy.uint64)
+
+
+class MinHasher:
+
+    def __init__(self, num_perm, seed=0):
+        rng = numpy.random.default_rng(seed)
+        self.a = rng.integers(1, 2 ** 32, size=num_perm, dtype=numpy.uint64)[:, None]
+        self.b = rng.integers(0, 2 ** 32, size=num_perm, dtype=numpy.uint64)[:, None]
+
+    def signature(self, hashes):
+        return ((self.a * hashes[None, :] + self.b) % HASH_PRIME).min(axis=1)
+
+
+def lsh_candidates(signatures, bands):
+    """
+    Return the pairs of videos whose signatures are identical on at least one
+    band of rows.
+    """
+    if not signatures:
+        return set()
+    rows = len(next(iter(signatures.values()))) // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = dict()
+        for video_id, signature in signatures.items():
+            key = signature[band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(key, list()).append(video_id)
+        for bucket in buckets.values():
+            pairs.update(itertools.combinations(sorted(bucket), 2))
+    return pairs
+
+
+def estimate_jaccard(a, b):
+    return float(numpy.mean(a == b))
+
+
+def group_duplicates(links):
+    """Group videos connected by near-duplicate links (union-find)."""
+    parent = dict()
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b, _ in links:
+        parent[find(a)] = find(b)
+    groups = dict()
+    for x in parent:
+        groups.setdefault(find(x), list()).append(x)
+    return [sorted(group) for group in groups.values()]
+
+
+def action_duplicates(youtube_path, folder, output_path, shingle_size, num_perm, bands, threshold):
+    import webvtt
+    from tfidf import merge_captions
+    if num_perm % bands != 0:
+        raise ValueError("The number of permutations must be a multiple of the number of bands")
+    with codecs.open(youtube_path, "r", "utf8") as file:
+        rows = {row["id"]: row for row in simplejson.load(file)["entries"]}
+    hasher = MinHasher(num_perm)
+    signatures = dict()
+    for video_id in tqdm.tqdm(rows):
+        path = os.path.join(folder, video_id + ".fr.vtt")
+        if not os.path.isfile(path):
+            continue
+        hashes = shingle_hashes(merge_captions(webvtt.read(path)), shingle_size)
+        # Videos without enough caption text have no signature: grouping
+        # them would only say that they are all empty.
+        if hashes.size > 0:
+            signatures[video_id] = hasher.signature(hashes)
+    pairs = lsh_candidates(signatures, bands)
+    logging.info(
+        "Comparing %d candidate pairs out of %d",
+        len(pairs),
+        len(signatures) * (len(signatures) - 1) // 2
+    )
+    links = list()
+    for a, b in pairs:
+        similarity = estimate_jaccard(signatures[a], signatures[b])
+        if similarity >= threshold:
+            links.append((a, b, similarity))
+    similarities = dict()
+    for a, b, similarity in links:
+        similarities[a] = max(similarities.get(a, 0), similarity)
+        similarities[b] = max(similarities.get(b, 0), similarity)
+    groups = group_duplicates(links)
+    groups.sort(key=lambda group: -len(group))
+    logging.info("Found %d groups of near-duplicate videos", len(groups))
+    with codecs.open(output_path, "w", "utf8") as file:
+        file.write("\t".join(["group", "id", "jaccard", "channel_name", "video_title"]) + "\n")
+        for group_id, group in enumerate(groups):
+            for video_id in group:
+                file.write("\t".join([
+                    str(group_id),
+                    video_id,
+                    "%.3f" % similarities[video_id],
+                    rows[video_id].get("channel_name") or "",
+                    rows[video_id].get("video_title") or "",
+                ]) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--youtube", type=str, default="data/youtube.json")
+    parser.add_argument("--folder", type=str, default="data/youtube")
+    parser.add_argument("--output", type=str, default="duplicates.tsv")
+    parser.add_argument("--shingle-size", type=int, default=5, help="Words per shingle")
+    parser.add_argument("--num-perm", type=int, default=128, help="Length of the MinHash signatures")
+    parser.add_argument("--bands", type=int, default=32, help="LSH bands, must divide --num-perm")
+    parser.add_argument("--threshold", type=float, default=.5, help="Minimum estimated Jaccard similarity")
+    args = parser.parse_args()
+    action_duplicates(
+        args.youtube,
+        args.folder,
+        args.output,
+        args.shingle_size,
+        args.num_perm,
+        args.bands,
+        args.threshold
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
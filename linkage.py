@@ -0,0 +1,274 @@
+"""
+This module generates a candidate alignment between the Inathèque, Madelen,
+lmdmfr and YouTube records, as a starting point for data/alignment.tsv.
+Record pairs are only scored if they share a blocking key (title n-gram,
+diffusion year and collection), which avoids comparing every record
+against every other.
+"""
+
+import argparse
+import codecs
+import difflib
+import itertools
+import logging
+import re
+import unicodedata
+import tqdm
+from merge import load_and_index, load_alignment, COLLECTION_CANONIZED, MergeOperator
+
+
+SOURCE_KEYS = {
+    "inatheque": "id",
+    "madelen": "uri",
+    "lmdmfr": "id",
+    "youtube": "id",
+}
+
+NGRAM_SIZE = 4
+MAX_BLOCK_PAIRS = 2500  # blocks generating more pairs are not discriminative
+
+
+def normalize_title(title):
+    if title is None:
+        return ""
+    title = unicodedata.normalize("NFD", title.lower())
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", title).strip()
+
+
+def create_record(source, key, row):
+    collection = row.get("collection")
+    return {
+        "source": source,
+        "key": key,
+        "title": normalize_title(row.get("title")),
+        "date": row.get("diffusion_date"),
+        "year": row["diffusion_date"][:4] if row.get("diffusion_date") else None,
+        "collection": COLLECTION_CANONIZED.get(collection, collection),
+    }
+
+
+def load_records(paths):
+    records = dict()
+    for source, path in paths.items():
+        if path is None:
+            continue
+        index = load_and_index(path, SOURCE_KEYS[source])
+        records[source] = [
+            create_record(source, key, row)
+            for key, row in index.items()
+        ]
+        logging.info("Loaded %d %s records", len(records[source]), source)
+    return records
+
+
+def blocking_keys(record):
+    keys = set()
+    compact = record["title"].replace(" ", "")
+    if len(compact) < NGRAM_SIZE:
+        if compact:
+            keys.add("t:" + compact)
+    else:
+        for i in range(len(compact) - NGRAM_SIZE + 1):
+            keys.add("t:" + compact[i:i+NGRAM_SIZE])
+    if record["year"] is not None and record["collection"] is not None:
+        keys.add("y:%s|c:%s" % (record["year"], record["collection"]))
+    return keys
+
+
+def build_blocks(records):
+    blocks = dict()
+    for i, record in enumerate(records):
+        for key in blocking_keys(record):
+            blocks.setdefault(key, list()).append(i)
+    return blocks
+
+
+def candidate_pairs(records_a, records_b):
+    """
+    Return the set of index pairs (i, j) sharing at least one block small
+    enough to be discriminative.
+    """
+    blocks_a = build_blocks(records_a)
+    blocks_b = build_blocks(records_b)
+    pairs = set()
+    for key, block_a in blocks_a.items():
+        block_b = blocks_b.get(key)
+        if block_b is None or len(block_a) * len(block_b) > MAX_BLOCK_PAIRS:
+            continue
+        pairs.update(itertools.product(block_a, block_b))
+    return pairs
+
+
+def score_date(a, b):
+    if a["date"] is None or b["date"] is None:
+        return .5
+    if a["date"] == b["date"]:
+        return 1.
+    if a["year"] == b["year"]:
+        return .5
+    if abs(int(a["year"]) - int(b["year"])) <= 1:
+        return .25
+    return 0.
+
+
+def score_collection(a, b):
+    if a["collection"] is None or b["collection"] is None:
+        return .5
+    return 1. if a["collection"] == b["collection"] else 0.
+
+
+def score_pair(a, b):
+    title = difflib.SequenceMatcher(None, a["title"], b["title"]).ratio()
+    return .7 * title + .2 * score_date(a, b) + .1 * score_collection(a, b)
+
+
+def link_sources(records, threshold):
+    """
+    Score the candidate pairs of every couple of sources and return the
+    links above the threshold, best first.
+    """
+    links = list()
+    for source_a, source_b in itertools.combinations(MergeOperator.SOURCES, 2):
+        if source_a not in records or source_b not in records:
+            continue
+        pairs = candidate_pairs(records[source_a], records[source_b])
+        logging.info(
+            "Scoring %d/%d candidate pairs between %s and %s",
+            len(pairs),
+            len(records[source_a]) * len(records[source_b]),
+            source_a,
+            source_b
+        )
+        for i, j in tqdm.tqdm(pairs):
+            a = records[source_a][i]
+            b = records[source_b][j]
+            score = score_pair(a, b)
+            if score >= threshold:
+                links.append((score, a, b))
+    links.sort(key=lambda link: -link[0])
+    return links
+
+
+def cluster_links(records, links):
+    """
+    Greedily group records into documents, best links first, with at most
+    one record per source in each document.
+    """
+    cluster_of = dict()
+    clusters = dict()
+    for source, source_records in records.items():
+        for record in source_records:
+            ident = (source, record["key"])
+            cluster_of[ident] = ident
+            clusters[ident] = {"members": {source: record["key"]}, "score": None}
+    for score, a, b in links:
+        root_a = cluster_of[(a["source"], a["key"])]
+        root_b = cluster_of[(b["source"], b["key"])]
+        if root_a == root_b:
+            continue
+        members_a = clusters[root_a]["members"]
+        members_b = clusters[root_b]["members"]
+        if set(members_a).intersection(members_b):
+            continue
+        members_a.update(members_b)
+        scores = [s for s in [clusters[root_a]["score"], clusters[root_b]["score"], score] if s is not None]
+        clusters[root_a]["score"] = min(scores)
+        for source, key in members_b.items():
+            cluster_of[(source, key)] = root_a
+        del clusters[root_b]
+    return list(clusters.values())
+
+
+def evaluate(clusters, alignment_path):
+    """
+    Log, for every couple of sources, how many hand-aligned pairs are
+    reproduced by the candidate alignment.
+    """
+    reference = load_alignment(alignment_path)
+    predicted = [cluster["members"] for cluster in clusters]
+    for source_a, source_b in itertools.combinations(MergeOperator.SOURCES, 2):
+        expected = set(
+            (row[source_a], row[source_b])
+            for row in reference
+            if row.get(source_a) is not None and row.get(source_b) is not None
+        )
+        found = set(
+            (members[source_a], members[source_b])
+            for members in predicted
+            if source_a in members and source_b in members
+        )
+        if len(expected) == 0 or len(found) == 0:
+            continue
+        hits = len(expected.intersection(found))
+        logging.info(
+            "%s ∩ %s: %d/%d hand pairs reproduced (recall %.3f, precision %.3f)",
+            source_a,
+            source_b,
+            hits,
+            len(expected),
+            hits / len(expected),
+            hits / len(found)
+        )
+
+
+def write_alignment(clusters, output_path):
+    clusters = sorted(clusters, key=lambda cluster: len(cluster["members"]) == 1)
+    with codecs.open(output_path, "w", "utf8") as file:
+        file.write("\t".join(["doc_id"] + MergeOperator.SOURCES[::-1] + ["score"]) + "\n")
+        for doc_id, cluster in enumerate(clusters):
+            cells = [str(doc_id)]
+            for source in MergeOperator.SOURCES[::-1]:
+                key = cluster["members"].get(source)
+                cells.append("" if key is None else str(key))
+            cells.append("" if cluster["score"] is None else "%.4f" % cluster["score"])
+            file.write("\t".join(cells) + "\n")
+
+
+def action_link(paths, threshold, output_path, alignment_path):
+    records = load_records(paths)
+    links = link_sources(records, threshold)
+    clusters = cluster_links(records, links)
+    logging.info("Grouped records into %d candidate documents", len(clusters))
+    write_alignment(clusters, output_path)
+    if alignment_path is not None:
+        evaluate(clusters, alignment_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inatheque", type=str, default="data/inatheque.json")
+    parser.add_argument("--madelen", type=str, default="data/madelen.json")
+    parser.add_argument("--lmdmfr", type=str, default="data/lmdmfr.json")
+    parser.add_argument("--youtube", type=str, default="data/youtube.json")
+    parser.add_argument("--threshold", type=float, default=.75)
+    parser.add_argument("--output", type=str, default="alignment.candidates.tsv")
+    parser.add_argument(
+        "--alignment",
+        type=str,
+        default="data/alignment.tsv",
+        help="Hand alignment to evaluate the candidates against"
+    )
+    parser.add_argument(
+        "--skip",
+        type=str,
+        nargs="*",
+        default=[],
+        choices=MergeOperator.SOURCES,
+        help="Sources to leave out of the linkage"
+    )
+    args = parser.parse_args()
+    paths = {
+        "inatheque": args.inatheque,
+        "madelen": args.madelen,
+        "lmdmfr": args.lmdmfr,
+        "youtube": args.youtube,
+    }
+    for source in args.skip:
+        paths[source] = None
+    action_link(paths, args.threshold, args.output, args.alignment)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,11 +1,25 @@
 import argparse
 import codecs
+import contextlib
+import csv
+import gzip
+import hashlib
+import os
+import collections
+import functools
 import simplejson
 import itertools
+import multiprocessing
 import difflib
-import pandas
 import slugify
+import time
 import tqdm
+import unicodedata
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 COLLECTION_CANONIZED = {
@@ -57,6 +71,10 @@ def load_alignment(path):
     return rows
 
 
+def popcount(mask):
+    return bin(mask).count("1")
+
+
 def check_alignment(alignment):
     header = alignment[0].keys()
     for key in header:
@@ -64,28 +82,190 @@ def check_alignment(alignment):
         assert len(values) == len(set(values)), key
     print("Alignment IDs are unique: True")
     header_without_doc_id = [x for x in header if x != "doc_id"]
+    masks = {key: 0 for key in header_without_doc_id}
+    for i, row in enumerate(alignment):
+        for key in header_without_doc_id:
+            if row[key] is not None:
+                masks[key] |= 1 << i
+    sizes = {key: popcount(mask) for key, mask in masks.items()}
     overlaps = dict()
-    for r in range(1, 5):
+    for r in range(1, len(header_without_doc_id) + 1):
         for combination in itertools.combinations(header_without_doc_id, r):
-            key = combination[0]
-            values = [row for row in alignment if row[key] is not None]
+            mask = masks[combination[0]]
             for key in combination[1:]:
-                values = [row for row in values if row[key] is not None]
-            overlaps[combination] = len(values)
+                mask &= masks[key]
+            overlaps[combination] = popcount(mask)
     print("Overlaps:")
     for intersection, size in overlaps.items():
         if len(intersection) == 1:
             print("\t" + " \u2229 ".join(intersection) + ": %s" % size)
             continue
-        target = min([
-            len([row[key] for row in alignment if row[key] is not None])
-            for key in intersection
-        ])
+        target = min([sizes[key] for key in intersection])
         print("\t" + " \u2229 ".join(intersection) + ": %s (%s)" % (size, target))
 
 
-def compare_text(a, b, threshold):
-    return difflib.SequenceMatcher(None, a, b).ratio() > threshold
+SLUG_CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=SLUG_CACHE_SIZE)
+def slug(value):
+    """
+    Process-wide memoized slugify; hits and misses are available through
+    `slug.cache_info()`.
+    """
+    return slugify.slugify(value)
+
+
+class TextSimilarity:
+    """
+    Memoized SequenceMatcher ratios for the duration of a merge run. Each
+    string is profiled once (length and character counts); these give upper
+    bounds on the ratio that reject most dissimilar pairs without running
+    difflib. Exact ratios are computed at most once per pair of strings.
+    """
+
+    def __init__(self):
+        self.profiles = dict()
+        self.ratios = dict()
+        self.stats = collections.Counter()
+
+    def _profile(self, string):
+        if string not in self.profiles:
+            self.profiles[string] = (len(string), collections.Counter(string))
+        return self.profiles[string]
+
+    def _upper_bound(self, a, b):
+        len_a, counts_a = self._profile(a)
+        len_b, counts_b = self._profile(b)
+        total = len_a + len_b
+        if total == 0:
+            return 1.
+        if min(len_a, len_b) == 0:
+            return 0.
+        return 2. * sum((counts_a & counts_b).values()) / total
+
+    def ratio(self, a, b):
+        key = (a, b)
+        if key not in self.ratios:
+            self.stats["exact_ratios"] += 1
+            self.ratios[key] = difflib.SequenceMatcher(None, a, b).ratio()
+        else:
+            self.stats["memo_hits"] += 1
+        return self.ratios[key]
+
+    def similar(self, a, b, threshold):
+        if (a, b) not in self.ratios:
+            len_a, _ = self._profile(a)
+            len_b, _ = self._profile(b)
+            total = len_a + len_b
+            if total > 0 and 2. * min(len_a, len_b) / total <= threshold:
+                self.stats["length_rejections"] += 1
+                return False
+            if self._upper_bound(a, b) <= threshold:
+                self.stats["count_rejections"] += 1
+                return False
+        return self.ratio(a, b) > threshold
+
+
+CONFLICT_FIELDS = ["doc_id", "field", "source_a", "value_a", "source_b", "value_b", "similarity"]
+DECISION_FIELDS = ["doc_id", "field", "val_count", "source", "value", "priority_consensus", "priority_source"]
+
+
+class ReportSink:
+
+    def write(self, row):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ListReportSink(ReportSink):
+
+    def __init__(self):
+        self.rows = list()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def write(self, row):
+        self.rows.append(row)
+
+    def drain(self):
+        """Return the rows written so far and forget them."""
+        rows, self.rows = self.rows, list()
+        return rows
+
+
+class CsvReportSink(ReportSink):
+
+    def __init__(self, path, fieldnames):
+        self.file = codecs.open(path, "w", "utf8")
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, lineterminator="\n")
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesReportSink(ReportSink):
+
+    def __init__(self, path):
+        self.file = codecs.open(path, "w", "utf8")
+
+    def write(self, row):
+        self.file.write(simplejson.dumps(row) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class CounterReportSink(ReportSink):
+    """
+    Aggregate rows into counts per field and per source.
+    """
+
+    def __init__(self, source_keys):
+        self.source_keys = source_keys
+        self.total = 0
+        self.counts = collections.Counter()
+
+    def write(self, row):
+        self.total += 1
+        for key in self.source_keys:
+            self.counts[(row["field"], row[key])] += 1
+
+    def table(self):
+        fields = sorted(set(field for field, _ in self.counts))
+        lines = ["\t".join(["field"] + MergeOperator.SOURCES)]
+        for field in fields:
+            lines.append("\t".join(
+                [field] + [str(self.counts[(field, source)]) for source in MergeOperator.SOURCES]
+            ))
+        return "\n".join(lines)
+
+
+class MultiReportSink(ReportSink):
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, row):
+        for sink in self.sinks:
+            sink.write(row)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def create_report_sink(basename, fieldnames, report_format):
+    if report_format == "jsonl":
+        return JsonLinesReportSink(basename + ".jsonl")
+    return CsvReportSink(basename + ".csv", fieldnames)
 
 
 class MergeField:
@@ -126,6 +306,84 @@ class NestedMergeField(MergeField):
         return None
 
 
+class MergeProfiler:
+    """
+    Optional instrumentation of a MergeOperator: call counts and cumulative
+    time of every merge_* method and of every field comparator, plus any
+    section timed with `timer`. Slug cache hits and misses are counted from
+    the time the operator is instrumented, so that each worker of a parallel
+    merge reports its own.
+    """
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.times = collections.Counter()
+        self.counters = collections.Counter()
+        self.slug_info = slug.cache_info()
+
+    def timed(self, name, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.calls[name] += 1
+                self.times[name] += time.perf_counter() - start
+        return wrapper
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.calls[name] += 1
+            self.times[name] += time.perf_counter() - start
+
+    def instrument(self, operator):
+        operator.profiler = self
+        self.slug_info = slug.cache_info()
+        for name in dir(operator):
+            if name.startswith("merge_"):
+                setattr(operator, name, self.timed(name, getattr(operator, name)))
+
+    def collect(self, operator):
+        for key, value in operator.similarity.stats.items():
+            self.counters["similarity." + key] += value
+        slug_info = slug.cache_info()
+        self.counters["slug.hits"] += slug_info.hits - self.slug_info.hits
+        self.counters["slug.misses"] += slug_info.misses - self.slug_info.misses
+        self.slug_info = slug_info
+
+    def update(self, data):
+        for name, calls in data["calls"].items():
+            self.calls[name] += calls
+        for name, elapsed in data["times"].items():
+            self.times[name] += elapsed
+        for name, value in data["counters"].items():
+            self.counters[name] += value
+
+    def export(self):
+        return {
+            "calls": dict(self.calls),
+            "times": dict(self.times),
+            "counters": dict(self.counters),
+        }
+
+    def table(self):
+        lines = ["%-32s %10s %10s %12s" % ("name", "calls", "time (s)", "per call (us)")]
+        for name, elapsed in self.times.most_common():
+            lines.append("%-32s %10d %10.3f %12.1f" % (
+                name,
+                self.calls[name],
+                elapsed,
+                1e6 * elapsed / max(1, self.calls[name])
+            ))
+        for name, value in sorted(self.counters.items()):
+            lines.append("%-32s %10d" % (name, value))
+        return "\n".join(lines)
+
+
 class MergeOperator:
 
     SOURCES = ["youtube", "lmdmfr", "madelen", "inatheque"]
@@ -136,13 +394,15 @@ class MergeOperator:
         "inatheque": 4
     }
 
-    def __init__(self, inatheque, youtube, madelen, lmdmfr):
+    def __init__(self, inatheque, youtube, madelen, lmdmfr, conflicts=None, decisions=None):
         self.inatheque = inatheque
         self.youtube = youtube
         self.madelen = madelen
         self.lmdmfr = lmdmfr
-        self.conflicts = list()
-        self.decisions = list()
+        self.conflicts = conflicts if conflicts is not None else ListReportSink()
+        self.decisions = decisions if decisions is not None else ListReportSink()
+        self.similarity = TextSimilarity()
+        self.profiler = None
     
     def _get_field_values(self, doc, field):
         result = list()
@@ -168,10 +428,10 @@ class MergeOperator:
             "similarity": None,
         }
         if isinstance(val_a["value"], str):
-            d["similarity"] = difflib.SequenceMatcher(None, val_a["value"], val_b["value"]).ratio()
+            d["similarity"] = self.similarity.ratio(val_a["value"], val_b["value"])
         elif isinstance(val_a["value"], int) or isinstance(val_a["value"], float):
             d["similarity"] = - abs(val_a["value"] - val_b["value"])
-        self.conflicts.append(d)
+        self.conflicts.write(d)
     
     def _add_decision(self, doc, field, val, val_count):
         elem = {
@@ -180,7 +440,7 @@ class MergeOperator:
             "val_count": val_count
         }
         elem.update(**val)
-        self.decisions.append(elem)
+        self.decisions.write(elem)
     
     def _quotient(self, vals, comparator):
         if len(vals) == 0:
@@ -198,6 +458,8 @@ class MergeOperator:
         return reps
 
     def _merge_field(self, doc, field, comparator):
+        if self.profiler is not None:
+            comparator = self.profiler.timed("compare." + field.label, comparator)
         vals = self._get_field_values(doc, field)
         if len(vals) == 0:
             return None
@@ -215,22 +477,28 @@ class MergeOperator:
         return vals[0]["value"]
     
     def _merge_text_field(self, doc, field, threshold):
-        return self._merge_field(doc, field, lambda a, b: compare_text(a, b, threshold))
+        return self._merge_field(doc, field, lambda a, b: self.similarity.similar(a, b, threshold))
     
     def _merge_int_field(self, doc, field, thresold):
         return self._merge_field(doc, field, lambda a, b: abs(a - b) < thresold)
 
     def _merge_list_field(self, doc, field, cmpk):
+        def same_keys(keys_a, keys_b):
+            return keys_a == keys_b
+        if self.profiler is not None:
+            same_keys = self.profiler.timed("compare." + field.label, same_keys)
         vals = self._get_field_values(doc, field)
+        names_per_val = dict()
+        slugs_per_val = dict()
         keys_per_val = dict()
         for i, val in enumerate(vals):
-            keys_per_val[i] = set()
-            for elem in val["value"]:
-                keys_per_val[i].add(slugify.slugify(cmpk(elem)))
+            names_per_val[i] = [cmpk(elem) for elem in val["value"]]
+            slugs_per_val[i] = [slug(name) for name in names_per_val[i]]
+            keys_per_val[i] = set(slugs_per_val[i])
         for i, val_a in enumerate(vals):
             for k, val_b in enumerate(vals[i+1:]):
                 j = k + i + 1
-                if keys_per_val[i] != keys_per_val[j]:
+                if not same_keys(keys_per_val[i], keys_per_val[j]):
                     intersect = keys_per_val[i].intersection(keys_per_val[j])
                     self._add_conflict(
                         doc,
@@ -238,25 +506,27 @@ class MergeOperator:
                         {
                             "source": val_a["source"],
                             "value": [
-                                cmpk(x) for x in val_a["value"]
-                                if slugify.slugify(cmpk(x)) not in intersect
+                                name
+                                for name, key in zip(names_per_val[i], slugs_per_val[i])
+                                if key not in intersect
                             ]
                         },
                         {
                             "source": val_b["source"],
                             "value": [
-                                cmpk(x) for x in val_b["value"]
-                                if slugify.slugify(cmpk(x)) not in intersect
+                                name
+                                for name, key in zip(names_per_val[j], slugs_per_val[j])
+                                if key not in intersect
                             ]
                         }
                     )
         union = dict()
-        for val in vals:
-            for part in val["value"]:
-                if slugify.slugify(cmpk(part)) in union:
-                    union[slugify.slugify(cmpk(part))].update(**part)
+        for i, val in enumerate(vals):
+            for part, key in zip(val["value"], slugs_per_val[i]):
+                if key in union:
+                    union[key].update(**part)
                 else:
-                    union[slugify.slugify(cmpk(part))] = part
+                    union[key] = part
         result = sorted(union.values(), key=cmpk)
         return result
 
@@ -303,7 +573,462 @@ class MergeOperator:
         return self._merge_list_field(doc, SimpleMergeField("descriptors"), lambda x: x["label"])
 
 
-def action_merge(path_alignment, path_inatheque, path_madelen, path_lmdmfr, path_youtube, path_merger):
+def merge_document(operator, doc):
+    entry = {
+        "doc_id": doc["doc_id"],
+        "links": {
+            "inatheque_id": None,
+            "inatheque_uri": None,
+            "lmdmfr_id": None,
+            "lmdmfr_uri": None,
+            "madelen_uri": None,
+            "youtube_id": None,
+            "youtube_uri": None,
+        },
+        "opening": None,
+        "title": operator.merge_title(doc),
+        "collection": operator.merge_collection(doc),
+        "diffusion_date": operator.merge_diffusion_date(doc),
+        "duration": operator.merge_duration(doc),
+        "credits": {
+            "author": operator.merge_author(doc),
+            "directors": operator.merge_directors(doc),
+            "producers": operator.merge_producers(doc),
+            "cast": operator.merge_cast(doc),
+            "crew": operator.merge_crew(doc),
+        },
+        "summary": {
+            "pitch": operator.merge_pitch(doc),
+            "beginning": operator.merge_beginning(doc),
+            "end": operator.merge_end(doc),
+        },
+        "descriptors": operator.merge_descriptors(doc),
+        "facets": list(),
+        "relevant_words": list(),
+        "chapters": list(),
+        "similar": list(),
+    }
+
+    if doc["youtube"] is not None:
+        ref = operator.youtube[doc["youtube"]]
+        entry["links"]["youtube_id"] = ref["id"]
+        entry["links"]["youtube_uri"] = ref["uri"]
+        entry["opening"] = ref["opening"]
+        entry["facets"] = ref["facets"]
+        entry["relevant_words"] = ref["relevant_words"]
+        entry["chapters"] = ref["chapters"]
+
+    if doc["lmdmfr"] is not None:
+        ref = operator.lmdmfr[doc["lmdmfr"]]
+        entry["links"]["lmdmfr_id"] = ref["id"]
+        entry["links"]["lmdmfr_uri"] = ref["uri"]
+
+    if doc["madelen"] is not None:
+        ref = operator.madelen[doc["madelen"]]
+        entry["links"]["madelen_uri"] = ref["uri"]
+    if doc["inatheque"] is not None:
+        ref = operator.inatheque[doc["inatheque"]]
+        entry["links"]["inatheque_id"] = ref["id"]
+        entry["links"]["inatheque_uri"] = ref["uri"]
+
+    return entry
+
+
+_WORKER_SOURCES = None
+
+
+def _init_merge_worker(sources):
+    global _WORKER_SOURCES
+    if sources is not None:
+        _WORKER_SOURCES = sources
+
+
+def merge_document_with_reports(operator, doc):
+    """
+    Merge a document with an operator whose sinks are ListReportSink, and
+    return the entry along with the conflicts and decisions it produced.
+    """
+    entry = merge_document(operator, doc)
+    return entry, operator.conflicts.drain(), operator.decisions.drain()
+
+
+def _merge_chunk(args):
+    chunk, profile = args
+    operator = MergeOperator(*_WORKER_SOURCES)
+    profiler = None
+    if profile:
+        profiler = MergeProfiler()
+        profiler.instrument(operator)
+    results = [merge_document_with_reports(operator, doc) for doc in chunk]
+    if profiler is not None:
+        profiler.collect(operator)
+        profiler = profiler.export()
+    return results, profiler
+
+
+def merge_documents(operator, alignment, jobs=1, chunk_size=50):
+    """
+    Merge every alignment row and yield, in alignment order, each entry
+    along with its conflicts and decisions, so that reports can be written
+    as documents are merged. The operator must keep its default list sinks.
+    With several jobs, chunks of rows are merged by a process pool; sources
+    are inherited through fork when available, otherwise sent once to each
+    worker. Workers profile their own operators if the main operator is
+    instrumented.
+    """
+    if jobs <= 1:
+        for doc in tqdm.tqdm(alignment):
+            yield merge_document_with_reports(operator, doc)
+        return
+    global _WORKER_SOURCES
+    sources = (operator.inatheque, operator.youtube, operator.madelen, operator.lmdmfr)
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        _WORKER_SOURCES = sources
+        initargs = (None,)
+    else:
+        context = multiprocessing.get_context()
+        initargs = (sources,)
+    chunks = [
+        alignment[i:i+chunk_size]
+        for i in range(0, len(alignment), chunk_size)
+    ]
+    profile = operator.profiler is not None
+    try:
+        with context.Pool(jobs, _init_merge_worker, initargs) as pool:
+            results = pool.imap(_merge_chunk, [(chunk, profile) for chunk in chunks])
+            for chunk_results, profile_data in tqdm.tqdm(results, total=len(chunks)):
+                if profile_data is not None:
+                    operator.profiler.update(profile_data)
+                yield from chunk_results
+    finally:
+        _WORKER_SOURCES = None
+
+
+MERGE_VERSION = 1  # bump whenever the merge logic changes
+
+
+def content_hash(value):
+    return hashlib.sha1(
+        simplejson.dumps(value, sort_keys=True).encode("utf8")
+    ).hexdigest()
+
+
+def hash_inputs(alignment, operator):
+    """
+    Hash every source record referenced by the alignment, every alignment
+    row, and derive for each document a hash of all its merge inputs.
+    """
+    sources = {source: dict() for source in MergeOperator.SOURCES}
+    rows = dict()
+    documents = dict()
+    for doc in alignment:
+        parts = [str(MERGE_VERSION)]
+        rows[str(doc["doc_id"])] = content_hash(doc)
+        parts.append(rows[str(doc["doc_id"])])
+        for source in MergeOperator.SOURCES:
+            if doc[source] is None:
+                parts.append("")
+                continue
+            key = str(doc[source])
+            if key not in sources[source]:
+                sources[source][key] = content_hash(getattr(operator, source)[doc[source]])
+            parts.append(sources[source][key])
+        documents[str(doc["doc_id"])] = hashlib.sha1(
+            "/".join(parts).encode("utf8")
+        ).hexdigest()
+    return {"sources": sources, "rows": rows, "documents": documents}
+
+
+def load_previous_merge(path_merger, path_manifest):
+    """
+    Return the entries and manifest of the previous run, or (None, None) if
+    they are missing or were produced by another merge version.
+    """
+    if not (os.path.isfile(path_merger) and os.path.isfile(path_manifest)):
+        return None, None
+    with codecs.open(path_manifest, "r", "utf8") as file:
+        manifest = simplejson.load(file)
+    if manifest.get("version") != MERGE_VERSION:
+        return None, None
+    with codecs.open(path_merger, "r", "utf8") as file:
+        entries = {
+            str(entry["doc_id"]): entry
+            for entry in simplejson.load(file)["entries"]
+        }
+    return entries, manifest
+
+
+class ManifestWriter:
+    """
+    Write the merge manifest one document at a time, to a temporary file
+    that replaces the previous manifest once closed.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.file = codecs.open(path + ".tmp", "w", "utf8")
+        self.file.write(simplejson.dumps(header)[:-1] + ', "documents": {')
+        self.count = 0
+
+    def write(self, doc_id, record):
+        if self.count > 0:
+            self.file.write(", ")
+        self.file.write(simplejson.dumps(doc_id) + ": " + simplejson.dumps(record))
+        self.count += 1
+
+    def close(self):
+        self.file.write("}}")
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+def splice_documents(alignment, hashes, stale, merged, previous_entries, previous_manifest, conflict_sink, decision_sink, manifest):
+    """
+    Assemble entries in alignment order from freshly merged documents,
+    consumed from the `merged` iterator as the stale documents come up, and
+    from the previous run. Conflicts, decisions and manifest records are
+    written as soon as each document is done.
+    """
+    entries = list()
+    for doc in alignment:
+        doc_id = str(doc["doc_id"])
+        if doc_id in stale:
+            entry, conflicts, decisions = next(merged)
+            record = {
+                "hash": hashes["documents"][doc_id],
+                "conflicts": conflicts,
+                "decisions": decisions,
+            }
+        else:
+            entry = previous_entries[doc_id]
+            record = previous_manifest["documents"][doc_id]
+        entries.append(entry)
+        for row in record["conflicts"]:
+            conflict_sink.write(row)
+        for row in record["decisions"]:
+            decision_sink.write(row)
+        manifest.write(doc_id, record)
+    return entries
+
+
+def link_similar(entries, youtube):
+    """
+    Turn the similar videos computed by tfidf.py into similar entries, once
+    every entry is merged and the doc ID of each video is known.
+    """
+    doc_ids = {
+        entry["links"]["youtube_id"]: entry["doc_id"]
+        for entry in entries
+        if entry["links"]["youtube_id"] is not None
+    }
+    for entry in entries:
+        entry["similar"] = list()
+        video_id = entry["links"]["youtube_id"]
+        if video_id is None:
+            continue
+        for item in youtube[video_id].get("similar", []):
+            if item["id"] in doc_ids:
+                entry["similar"].append({
+                    "doc_id": doc_ids[item["id"]],
+                    "score": item["score"],
+                })
+
+
+def join_entries(serialized, separator=", "):
+    return '{"entries": [' + separator.join(serialized) + ']}'
+
+
+def write_compressed(path, data):
+    """
+    Write `data` (bytes) along with precompressed .gz and .br variants, so
+    that a static server can serve them directly. Gzip output is
+    reproducible (no timestamp); brotli is skipped if not installed.
+    """
+    with open(path, "wb") as file:
+        file.write(data)
+    with open(path + ".gz", "wb") as file:
+        file.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + ".br", "wb") as file:
+            file.write(brotli.compress(data))
+
+
+def normalize_label(string):
+    """
+    Same normalization as `normalize` in www/master.js: lowercase, strip
+    accents, replace spaces with dashes.
+    """
+    if not string:
+        return None
+    string = unicodedata.normalize("NFD", string.lower())
+    string = "".join(c for c in string if not "\u0300" <= c <= "\u036f")
+    return string.replace(" ", "-").strip()
+
+
+INDEX_LIST_FIELDS = {
+    "directors": lambda entry: [x["name"] for x in entry["credits"]["directors"]],
+    "producers": lambda entry: [x["name"] for x in entry["credits"]["producers"]],
+    "cast": lambda entry: [x["name"] for x in entry["credits"]["cast"]],
+    "crew": lambda entry: [x["name"] for x in entry["credits"]["crew"]],
+    "descriptors": lambda entry: [x["label"] for x in entry["descriptors"]],
+    "relevant_words": lambda entry: [x["label"] for x in entry["relevant_words"]],
+}
+
+
+def build_index(entries):
+    """
+    Build the inverted index used by the front-end filters: for every
+    filterable value, the sorted list of matching doc IDs. Facet postings
+    are sorted by decreasing score, so that a minimum score selects a
+    prefix.
+    """
+    postings = {
+        field: collections.defaultdict(set)
+        for field in ["collection", "author", "opening", "source"] + list(INDEX_LIST_FIELDS)
+    }
+    facets = collections.defaultdict(list)
+    for entry in entries:
+        doc_id = entry["doc_id"]
+        if entry["collection"]:
+            postings["collection"][normalize_label(entry["collection"])].add(doc_id)
+        if entry["credits"]["author"]:
+            postings["author"][normalize_label(entry["credits"]["author"])].add(doc_id)
+        if entry["opening"]:
+            postings["opening"][entry["opening"]].add(doc_id)
+        for source in MergeOperator.SOURCES:
+            if entry["links"].get(source + "_uri"):
+                postings["source"][source].add(doc_id)
+        for field, getter in INDEX_LIST_FIELDS.items():
+            for value in getter(entry):
+                postings[field][value].add(doc_id)
+        for facet in entry["facets"]:
+            facets[facet["label"]].append((-facet["score"], doc_id))
+    index = {
+        field: {
+            value: sorted(doc_ids)
+            for value, doc_ids in sorted(values.items())
+        }
+        for field, values in postings.items()
+    }
+    index["facets"] = dict()
+    for label, items in sorted(facets.items()):
+        items.sort()
+        index["facets"][label] = {
+            "doc_ids": [doc_id for _, doc_id in items],
+            "scores": [-score for score, _ in items],
+        }
+    return index
+
+
+DETAILS_BLOCK_SIZE = 50  # must match DETAILS_BLOCK_SIZE in www/master.js
+
+
+def build_card(entry):
+    """
+    Keep only what the front-end needs to render and filter the list of
+    episodes; the rest is served by the detail blocks.
+    """
+    return {
+        "doc_id": entry["doc_id"],
+        "title": entry["title"],
+        "collection": entry["collection"],
+        "diffusion_date": entry["diffusion_date"],
+        "duration": entry["duration"],
+        "links": entry["links"],
+        "credits": {
+            "author": entry["credits"]["author"],
+        },
+        "cast_count": len(entry["credits"]["cast"]),
+        "summary": {
+            "beginning": entry["summary"]["beginning"],
+            "pitch": entry["summary"]["pitch"],
+        },
+    }
+
+
+def build_details(entry):
+    return {
+        "chapters": entry["chapters"],
+        "credits": {
+            "cast": entry["credits"]["cast"],
+            "crew": entry["credits"]["crew"],
+            "directors": entry["credits"]["directors"],
+            "producers": entry["credits"]["producers"],
+        },
+        "descriptors": entry["descriptors"],
+        "facets": entry["facets"],
+        "opening": entry["opening"],
+        "relevant_words": entry["relevant_words"],
+    }
+
+
+def write_cards_and_details(entries, path_merger):
+    """
+    Write the card index (merger.cards.json) and the detail blocks, each
+    holding the details of DETAILS_BLOCK_SIZE consecutive doc IDs.
+    """
+    write_compressed(
+        path_merger.replace(".json", ".cards.json"),
+        join_entries([simplejson.dumps(build_card(entry), sort_keys=True) for entry in entries]).encode("utf8")
+    )
+    folder = os.path.join(path_merger.replace(".json", ""), "details")
+    os.makedirs(folder, exist_ok=True)
+    blocks = dict()
+    for entry in entries:
+        block = blocks.setdefault(entry["doc_id"] // DETAILS_BLOCK_SIZE, dict())
+        block[str(entry["doc_id"])] = build_details(entry)
+    for block_id, block in blocks.items():
+        write_compressed(
+            os.path.join(folder, "%d.json" % block_id),
+            simplejson.dumps(block, sort_keys=True).encode("utf8")
+        )
+
+
+def write_merger(entries, path_merger, shards=False):
+    """
+    Derive merger.json (one entry per line, so that it stays diffable),
+    merger.min.json, their precompressed variants and optional
+    per-collection shards from a single compact serialization of each
+    entry. The filter index, card index and detail blocks used by the
+    front-end are written alongside.
+    """
+    serialized = [simplejson.dumps(entry, sort_keys=True) for entry in entries]
+    with open(path_merger, "wb") as file:
+        file.write(join_entries(serialized, ",\n").encode("utf8"))
+    write_compressed(
+        path_merger.replace(".json", ".min.json"),
+        join_entries(serialized).encode("utf8")
+    )
+    write_compressed(
+        path_merger.replace(".json", ".index.json"),
+        simplejson.dumps(build_index(entries), separators=(",", ":")).encode("utf8")
+    )
+    write_cards_and_details(entries, path_merger)
+    if not shards:
+        return
+    folder = path_merger.replace(".json", "")
+    os.makedirs(folder, exist_ok=True)
+    collections_serialized = dict()
+    for entry, string in zip(entries, serialized):
+        collections_serialized.setdefault(entry["collection"], list()).append(string)
+    manifest = list()
+    for collection, strings in collections_serialized.items():
+        filename = (slug(collection) if collection is not None else "none") + ".min.json"
+        write_compressed(
+            os.path.join(folder, filename),
+            join_entries(strings).encode("utf8")
+        )
+        manifest.append({
+            "collection": collection,
+            "path": filename,
+            "count": len(strings),
+        })
+    with codecs.open(os.path.join(folder, "manifest.json"), "w", "utf8") as file:
+        simplejson.dump({"shards": manifest}, file, indent=4)
+
+
+def action_merge(path_alignment, path_inatheque, path_madelen, path_lmdmfr, path_youtube, path_merger, jobs=1, full=False, shards=False, report_format="csv", profile_path=None):
     alignment = load_alignment(path_alignment)
     check_alignment(alignment)
 
@@ -341,77 +1066,81 @@ def action_merge(path_alignment, path_inatheque, path_madelen, path_lmdmfr, path
 
     youtube = load_and_index(path_youtube, "id")
     operator = MergeOperator(inatheque, youtube, madelen, lmdmfr)
-    entries = list()
-    for doc in tqdm.tqdm(alignment):
-        entry = {
-            "doc_id": doc["doc_id"],
-            "links": {
-                "inatheque_id": None,
-                "inatheque_uri": None,
-                "lmdmfr_id": None,
-                "lmdmfr_uri": None,
-                "madelen_uri": None,
-                "youtube_id": None,
-                "youtube_uri": None,
-            },
-            "opening": None,
-            "title": operator.merge_title(doc),
-            "collection": operator.merge_collection(doc),
-            "diffusion_date": operator.merge_diffusion_date(doc),
-            "duration": operator.merge_duration(doc),
-            "credits": {
-                "author": operator.merge_author(doc),
-                "directors": operator.merge_directors(doc),
-                "producers": operator.merge_producers(doc),
-                "cast": operator.merge_cast(doc),
-                "crew": operator.merge_crew(doc),
-            },
-            "summary": {
-                "pitch": operator.merge_pitch(doc),
-                "beginning": operator.merge_beginning(doc),
-                "end": operator.merge_end(doc),
-            },
-            "descriptors": operator.merge_descriptors(doc),
-            "facets": list(),
-            "relevant_words": list(),
-            "chapters": list()
-        }
+    profiler = None
 
-        if doc["youtube"] is not None:
-            ref = youtube[doc["youtube"]] 
-            entry["links"]["youtube_id"] = ref["id"]
-            entry["links"]["youtube_uri"] = ref["uri"]
-            entry["opening"] = ref["opening"]
-            entry["facets"] = ref["facets"]
-            entry["relevant_words"] = ref["relevant_words"]
-            entry["chapters"] = ref["chapters"]
-
-        if doc["lmdmfr"] is not None:
-            ref = lmdmfr[doc["lmdmfr"]] 
-            entry["links"]["lmdmfr_id"] = ref["id"]
-            entry["links"]["lmdmfr_uri"] = ref["uri"]
-
-        if doc["madelen"] is not None:
-            ref = madelen[doc["madelen"]] 
-            entry["links"]["madelen_uri"] = ref["uri"]
-        if doc["inatheque"] is not None:
-            ref = inatheque[doc["inatheque"]] 
-            entry["links"]["inatheque_id"] = ref["id"]
-            entry["links"]["inatheque_uri"] = ref["uri"]
+    def section(name):
+        return contextlib.nullcontext()
 
-        entries.append(entry)
+    if profile_path is not None:
+        profiler = MergeProfiler()
+        profiler.instrument(operator)
+        section = profiler.timer
+    path_manifest = path_merger.replace(".json", ".manifest.json")
+    with section("hashing"):
+        hashes = hash_inputs(alignment, operator)
+    previous_entries, previous_manifest = None, None
+    if not full:
+        previous_entries, previous_manifest = load_previous_merge(path_merger, path_manifest)
+    stale = list()
+    for doc in alignment:
+        doc_id = str(doc["doc_id"])
+        if previous_manifest is None or doc_id not in previous_entries:
+            stale.append(doc)
+            continue
+        previous_hash = previous_manifest["documents"].get(doc_id, {}).get("hash")
+        if previous_hash != hashes["documents"][doc_id]:
+            stale.append(doc)
+    print("Merging %d/%d documents with changed inputs" % (len(stale), len(alignment)))
+    conflict_counter = CounterReportSink(["source_a", "source_b"])
+    decision_counter = CounterReportSink(["source"])
+    conflict_sink = MultiReportSink(
+        create_report_sink("merger-conflicts", CONFLICT_FIELDS, report_format),
+        conflict_counter
+    )
+    decision_sink = MultiReportSink(
+        create_report_sink("merger-decisions", DECISION_FIELDS, report_format),
+        decision_counter
+    )
+    manifest = ManifestWriter(path_manifest, {
+        "version": MERGE_VERSION,
+        "sources": hashes["sources"],
+        "rows": hashes["rows"],
+    })
+    with section("merging"):
+        entries = splice_documents(
+            alignment,
+            hashes,
+            set(str(doc["doc_id"]) for doc in stale),
+            merge_documents(operator, stale, jobs),
+            previous_entries,
+            previous_manifest,
+            conflict_sink,
+            decision_sink,
+            manifest
+        )
+    conflict_sink.close()
+    decision_sink.close()
+    link_similar(entries, youtube)
 
-    print("Took %d decisions (see merger-decisions.csv)" % len(operator.decisions))
-    pandas.DataFrame(operator.decisions).to_csv("merger-decisions.csv", index=False)
-    print("Found %d conflicts (see merger-conflicts.csv)" % len(operator.conflicts))
-    pandas.DataFrame(operator.conflicts).to_csv("merger-conflicts.csv", index=False)
+    if jobs <= 1:
+        # Workers have their own caches, see --profile for their totals.
+        print("Slug cache: %s" % str(slug.cache_info()))
+    print("Took %d decisions (see merger-decisions.%s)" % (decision_counter.total, report_format))
+    print(decision_counter.table())
+    print("Found %d conflicts (see merger-conflicts.%s)" % (conflict_counter.total, report_format))
+    print(conflict_counter.table())
 
     print("Writing to disk...")
 
-    with codecs.open(path_merger, "w", "utf8") as file:
-        simplejson.dump({"entries": entries}, file, indent=4, sort_keys=True)
-    with codecs.open(path_merger.replace(".json", ".min.json"), "w", "utf8") as file:
-        simplejson.dump({"entries": entries}, file, sort_keys=True)
+    with section("serialization"):
+        write_merger(entries, path_merger, shards)
+        manifest.close()
+
+    if profiler is not None:
+        profiler.collect(operator)
+        print(profiler.table())
+        with codecs.open(profile_path, "w", "utf8") as file:
+            simplejson.dump(profiler.export(), file, indent=4, sort_keys=True)
 
 
 def main():
@@ -446,6 +1175,34 @@ def main():
         type=str,
         default="data/merger.json"
     )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Export per-method timings and comparison counters to this JSON file"
+    )
+    parser.add_argument(
+        "--report-format",
+        type=str,
+        choices=["csv", "jsonl"],
+        default="csv"
+    )
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help="Also write one minified file per collection along with a manifest"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the manifest of the previous run and merge every document"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1
+    )
     args = parser.parse_args()
     action_merge(
         args.alignement,
@@ -453,7 +1210,12 @@ def main():
         args.madelen,
         args.lmdmfr,
         args.youtube,
-        args.merger
+        args.merger,
+        args.jobs,
+        args.full,
+        args.shards,
+        args.report_format,
+        args.profile
     )
 
 
@@ -0,0 +1,271 @@
+"""
+This module runs the scripts of the repository in dependency order, and only
+the ones whose inputs changed since their last successful run.
+
+Each stage declares the files it reads and writes, as paths or glob
+patterns. A stage depends on every earlier stage writing one of its inputs.
+A stage is stale if its command, its script or one of its inputs changed,
+or if one of its outputs is missing; stages whose dependencies are done
+run concurrently.
+"""
+
+import argparse
+import codecs
+import concurrent.futures
+import glob
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import simplejson
+
+
+class Stage:
+
+    def __init__(self, name, script, args, inputs, outputs):
+        self.name = name
+        self.script = script
+        self.args = args
+        self.inputs = [script] + inputs
+        self.outputs = outputs
+
+    @property
+    def command(self):
+        return [sys.executable, self.script] + self.args
+
+
+# Appending inatheque.append.json and youtube.append.json to the main JSON
+# files is still done by hand, so the scraping stages are not connected to
+# the rest of the graph.
+STAGES = [
+    Stage(
+        "inatheque",
+        "inatheque.py",
+        ["-o", "inatheque.append.json", "inatheque-urls.txt"],
+        ["inatheque-urls.txt", "data/ina-names.tsv"],
+        ["inatheque.append.json"]
+    ),
+    Stage(
+        "youtube-download",
+        "youtube.py",
+        ["download", "youtube-ids.txt"],
+        ["youtube-ids.txt"],
+        ["data/youtube/*.info.json", "data/youtube/*.fr.vtt", "data/youtube/*.mp3"]
+    ),
+    Stage(
+        "youtube-parse",
+        "youtube.py",
+        ["parse", "youtube-ids.txt"],
+        # The MP3 files are read too, but tags.py rewrites their ID3 tags in
+        # place: their .info.json stands for them.
+        ["youtube-ids.txt", "data/youtube/*.info.json", "data/youtube/*.fr.vtt", "data/shazoom-mystere.bin", "data/facets.json"],
+        ["youtube.append.json"]
+    ),
+    Stage(
+        "captions",
+        "tfidf.py",
+        ["both"],
+        ["data/youtube.json", "data/stopwords.txt", "data/youtube/*.fr.vtt"],
+        ["data/youtube.json", "data/tfidf.npz"]
+    ),
+    Stage(
+        "transcripts",
+        "transcripts.py",
+        ["build"],
+        ["data/youtube.json", "data/youtube/*.fr.vtt"],
+        ["data/transcripts.index"]
+    ),
+    Stage(
+        "duplicates",
+        "duplicates.py",
+        [],
+        ["data/youtube.json", "data/youtube/*.fr.vtt"],
+        ["duplicates.tsv"]
+    ),
+    Stage(
+        "merge",
+        "merge.py",
+        [],
+        ["data/alignment.tsv", "data/inatheque.json", "data/madelen.json", "data/lmdmfr.json", "data/youtube.json"],
+        ["data/merger.json", "data/merger.min.json", "data/merger.index.json", "data/merger.cards.json"]
+    ),
+    Stage(
+        "tags",
+        "tags.py",
+        [],
+        ["data/merger.min.json", "data/youtube/*.mp3"],
+        ["data/albumarts"]
+    ),
+]
+
+
+def fingerprint(pattern):
+    """
+    Hash the content of a file, or the names, sizes and modification times
+    of the files matching a glob pattern, which avoids reading whole folders
+    of media files. Return None if nothing matches.
+    """
+    if glob.has_magic(pattern):
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            return None
+        digest = hashlib.sha1()
+        for path in paths:
+            stat = os.stat(path)
+            digest.update(("%s\t%d\t%d\n" % (os.path.basename(path), stat.st_size, stat.st_mtime_ns)).encode("utf8"))
+        return digest.hexdigest()
+    if os.path.isdir(pattern):
+        return fingerprint(os.path.join(pattern, "*"))
+    if not os.path.isfile(pattern):
+        return None
+    digest = hashlib.sha1()
+    with open(pattern, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_dependencies(stages):
+    """Map every stage name to the names of the earlier stages writing its inputs."""
+    dependencies = dict()
+    for i, stage in enumerate(stages):
+        dependencies[stage.name] = set(
+            other.name
+            for other in stages[:i]
+            if set(other.outputs).intersection(stage.inputs)
+            or set(other.outputs).intersection(stage.outputs)
+        )
+    return dependencies
+
+
+def load_state(path):
+    if not os.path.isfile(path):
+        return dict()
+    with codecs.open(path, "r", "utf8") as file:
+        return simplejson.load(file)
+
+
+def save_state(state, path):
+    with codecs.open(path + ".tmp", "w", "utf8") as file:
+        simplejson.dump(state, file, indent=4, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def staleness(stage, record):
+    """Return why the stage must run, or None if it is up to date."""
+    if record is None:
+        return "never ran"
+    if record["command"] != stage.command[1:]:
+        return "command changed"
+    for pattern in stage.inputs:
+        if fingerprint(pattern) != record["inputs"].get(pattern):
+            return "%s changed" % pattern
+    for pattern in stage.outputs:
+        if fingerprint(pattern) is None:
+            return "%s is missing" % pattern
+    return None
+
+
+class Runner:
+
+    def __init__(self, stages, state_path, forced=(), dry_run=False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.dependencies = build_dependencies(stages)
+        self.state_path = state_path
+        self.state = load_state(state_path)
+        self.forced = set(forced)
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+
+    def run_stage(self, stage):
+        """Run a stage if it is stale; return whether it succeeded."""
+        reason = "forced" if stage.name in self.forced else staleness(stage, self.state.get(stage.name))
+        if reason is None:
+            logging.info("[%s] up to date", stage.name)
+            return True
+        if self.dry_run:
+            logging.info("[%s] would run (%s): %s", stage.name, reason, " ".join(stage.command[1:]))
+            return True
+        missing = [pattern for pattern in stage.inputs if fingerprint(pattern) is None]
+        if missing:
+            # Not a failure: stages downstream can still run on the outputs
+            # of a previous run, e.g. when there is no new video to download.
+            logging.warning("[%s] skipped, missing inputs: %s", stage.name, ", ".join(missing))
+            return True
+        logging.info("[%s] running (%s): %s", stage.name, reason, " ".join(stage.command[1:]))
+        start = time.time()
+        result = subprocess.run(stage.command)
+        if result.returncode != 0:
+            logging.error("[%s] failed with exit code %d", stage.name, result.returncode)
+            return False
+        logging.info("[%s] done in %.1fs", stage.name, time.time() - start)
+        # Inputs are fingerprinted after the run, since some stages update
+        # their inputs in place (tfidf.py rewrites youtube.json).
+        record = {
+            "command": stage.command[1:],
+            "inputs": {pattern: fingerprint(pattern) for pattern in stage.inputs},
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with self.lock:
+            self.state[stage.name] = record
+            save_state(self.state, self.state_path)
+        return True
+
+    def run(self, targets, jobs):
+        """
+        Run the target stages, in dependency order, as soon as the stages
+        they depend on are done. Stages depending on a failed stage are
+        skipped. Return the names of the failed and skipped stages.
+        """
+        pending = [name for name in self.stages if name in targets]
+        done = set(name for name in self.stages if name not in targets)
+        failed = set()
+        running = dict()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            while pending or running:
+                for name in list(pending):
+                    dependencies = self.dependencies[name]
+                    if dependencies.intersection(failed):
+                        logging.warning("[%s] skipped, a dependency failed", name)
+                        failed.add(name)
+                        pending.remove(name)
+                    elif dependencies.issubset(done):
+                        running[executor.submit(self.run_stage, self.stages[name])] = name
+                        pending.remove(name)
+                if not running:
+                    continue
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.result():
+                        done.add(name)
+                    else:
+                        failed.add(name)
+        return failed
+
+
+def main():
+    names = [stage.name for stage in STAGES]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state", type=str, default="pipeline.state.json")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="Number of stages run at the same time")
+    parser.add_argument("--force", type=str, nargs="*", default=[], choices=names, help="Stages to run even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which stages would run")
+    parser.add_argument("stages", type=str, nargs="*", help="Stages to consider among %s (default: all)" % ", ".join(names))
+    args = parser.parse_args()
+    unknown = set(args.stages).difference(names)
+    if unknown:
+        parser.error("unknown stages: %s" % ", ".join(sorted(unknown)))
+    runner = Runner(STAGES, args.state, args.force, args.dry_run)
+    failed = runner.run(set(args.stages or names), args.jobs)
+    if failed:
+        logging.error("Failed or skipped stages: %s", ", ".join(sorted(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
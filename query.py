@@ -0,0 +1,211 @@
+"""
+This module answers filter queries over merger.json with the same semantics
+as the form of the website (www/master.js). The dataset is loaded once into
+columns and bitset indexes: every posting list of merger.index.json becomes
+an integer whose bit i is set if the i-th entry matches, and range filters
+are answered with prefix masks over sorted columns, so that a query is a
+handful of bitwise operations rather than a scan of the entries.
+"""
+
+import argparse
+import bisect
+import codecs
+import logging
+import re
+import simplejson
+from merge import build_index, normalize_label, popcount
+
+
+FACETS_DEFAULT_BOUND = 3  # same default as filterWithIndex in www/master.js
+
+LIST_FILTERS = ["directors", "producers", "cast", "crew", "descriptors", "relevant_words"]
+
+
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class RangeIndex:
+    """
+    Sorted column with the mask of the first k entries of the sorted order
+    for every k. Entries with a missing value are kept in a separate mask.
+    """
+
+    def __init__(self, values):
+        order = sorted((value, i) for i, value in enumerate(values) if value is not None)
+        self.keys = [value for value, _ in order]
+        self.prefixes = [0]
+        mask = 0
+        for _, i in order:
+            mask |= 1 << i
+            self.prefixes.append(mask)
+        self.missing = 0
+        for i, value in enumerate(values):
+            if value is None:
+                self.missing |= 1 << i
+
+    def at_least(self, bound):
+        return self.prefixes[-1] ^ self.prefixes[bisect.bisect_left(self.keys, bound)]
+
+    def at_most(self, bound):
+        return self.prefixes[bisect.bisect_right(self.keys, bound)]
+
+
+def round_minutes(duration):
+    """
+    Same rounding as Math.round(duration / 60) in JavaScript. A zero
+    duration is missing, as the form rejects falsy durations.
+    """
+    if not duration:
+        return None
+    return int(duration / 60 + .5)
+
+
+class Catalogue:
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.all = (1 << len(entries)) - 1
+        self.position = {entry["doc_id"]: i for i, entry in enumerate(entries)}
+        self.titles = [entry["title"] or "" for entry in entries]
+        self.pitches = [entry["summary"]["pitch"] for entry in entries]
+        self.postings = dict()
+        index = build_index(entries)
+        for field, values in index.items():
+            if field == "facets":
+                continue
+            self.postings[field] = {
+                value: self._mask(doc_ids)
+                for value, doc_ids in values.items()
+            }
+        self.facets = dict()
+        for label, facet in index["facets"].items():
+            scores = [None] * len(entries)
+            for doc_id, score in zip(facet["doc_ids"], facet["scores"]):
+                scores[self.position[doc_id]] = score
+            self.facets[label] = RangeIndex(scores)
+        self.ranges = {
+            "date": RangeIndex([entry["diffusion_date"] for entry in entries]),
+            "duration": RangeIndex([round_minutes(entry["duration"]) for entry in entries]),
+            "cast": RangeIndex([len(entry["credits"]["cast"]) for entry in entries]),
+        }
+
+    @classmethod
+    def load(cls, path):
+        with codecs.open(path, "r", "utf8") as file:
+            return cls(simplejson.load(file)["entries"])
+
+    def _mask(self, doc_ids):
+        mask = 0
+        for doc_id in doc_ids:
+            mask |= 1 << self.position[doc_id]
+        return mask
+
+    def _posting(self, field, value):
+        return self.postings[field].get(value, 0)
+
+    def match(self, filters):
+        """
+        Return the mask of the entries matching the filters, a dict keyed
+        like the command line options (`cast_min`, `facets_bound`...).
+        Missing or empty filters are ignored, like empty inputs in the form.
+        """
+        mask = self.all
+        for source in filters.get("source") or []:
+            mask &= self._posting("source", source)
+        if filters.get("collection"):
+            mask &= self._posting("collection", normalize_label(filters["collection"]))
+        if filters.get("author"):
+            mask &= self._posting("author", normalize_label(filters["author"]))
+        for field in LIST_FILTERS:
+            for value in filters.get(field) or []:
+                mask &= self._posting(field, value)
+        if filters.get("opening"):
+            union = 0
+            for key in filters["opening"]:
+                union |= self._posting("opening", key)
+            mask &= union
+        if filters.get("facets"):
+            bound = filters.get("facets_bound") or FACETS_DEFAULT_BOUND
+            for label in filters["facets"]:
+                if label not in self.facets:
+                    return 0
+                mask &= self.facets[label].at_least(bound)
+        for name, column in self.ranges.items():
+            # Entries without a date pass the date bounds, as null compares
+            # false to strings in JavaScript; the others need a value.
+            passthrough = column.missing if name == "date" else 0
+            if filters.get(name + "_min"):
+                mask &= column.at_least(filters[name + "_min"]) | passthrough
+            if filters.get(name + "_max"):
+                mask &= column.at_most(filters[name + "_max"]) | passthrough
+        if filters.get("title"):
+            pattern = re.compile(filters["title"], re.IGNORECASE)
+            for i in iter_bits(mask):
+                if not pattern.search(self.titles[i]):
+                    mask ^= 1 << i
+        if filters.get("pitch"):
+            pattern = re.compile(filters["pitch"], re.IGNORECASE)
+            for i in iter_bits(mask):
+                if not self.pitches[i] or not pattern.search(self.pitches[i]):
+                    mask ^= 1 << i
+        return mask
+
+    def count(self, filters):
+        return popcount(self.match(filters))
+
+    def query(self, filters):
+        return [self.entries[i] for i in iter_bits(self.match(filters))]
+
+
+def action_query(path_merger, filters, output_format):
+    catalogue = Catalogue.load(path_merger)
+    results = catalogue.query(filters)
+    logging.info("%d/%d entries match", len(results), len(catalogue.entries))
+    if output_format == "json":
+        print(simplejson.dumps({"entries": results}, indent=4, sort_keys=True))
+    else:
+        for entry in results:
+            print("\t".join([
+                str(entry["doc_id"]),
+                entry["diffusion_date"] or "",
+                entry["collection"] or "",
+                entry["title"] or "",
+            ]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--merger", type=str, default="data/merger.json")
+    parser.add_argument("--format", type=str, default="tsv", choices=["tsv", "json"])
+    parser.add_argument("--collection", type=str)
+    parser.add_argument("--author", type=str)
+    parser.add_argument("--title", type=str, help="Case insensitive regular expression")
+    parser.add_argument("--pitch", type=str, help="Case insensitive regular expression")
+    for field in LIST_FILTERS:
+        parser.add_argument("--" + field.replace("_", "-"), type=str, action="append", dest=field, help="Repeat to require several values")
+    parser.add_argument("--source", type=str, action="append", choices=["inatheque", "madelen", "lmdmfr", "youtube"])
+    parser.add_argument("--opening", type=str, action="append", help="Opening key, repeat to accept any of several")
+    parser.add_argument("--facets", type=str, action="append")
+    parser.add_argument("--facets-bound", type=int, help="Minimum facet score (default %d)" % FACETS_DEFAULT_BOUND)
+    parser.add_argument("--date-min", type=str, help="YYYY-MM-DD")
+    parser.add_argument("--date-max", type=str, help="YYYY-MM-DD")
+    parser.add_argument("--duration-min", type=int, help="Minutes")
+    parser.add_argument("--duration-max", type=int, help="Minutes")
+    parser.add_argument("--cast-min", type=int)
+    parser.add_argument("--cast-max", type=int)
+    args = parser.parse_args()
+    filters = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ["merger", "format"]
+    }
+    action_query(args.merger, filters, args.format)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -4,14 +4,17 @@ import codecs
 import logging
 import time
 import argparse
+import collections
+import csv
 import tqdm
 import requests
-import pandas
 import difflib
 
 
 TOKEN_API = "https://www.googleapis.com/oauth2/v4/token"
 SEARCH_API = "https://www.googleapis.com/youtube/v3/search"
+VIDEOS_API = "https://www.googleapis.com/youtube/v3/videos"
+VIDEOS_BATCH_SIZE = 50  # maximum number of IDs per videos.list call
 
 
 def refresh(token):
@@ -54,6 +57,75 @@ def search(token, query):
     return json.loads(response.text)
 
 
+def fetch_statistics(session, token, video_ids):
+    headers = {
+        "client-id": token["client_id"],
+        "Authorization": "Bearer %s" % token["access_token"]
+    }
+    params = {
+        "part": "statistics",
+        "id": ",".join(video_ids),
+    }
+    response = session.get(VIDEOS_API, params=params, headers=headers)
+    if response.status_code != 200:
+        logging.error(
+            "Error with the API connection, status %d",
+            response.status_code
+        )
+        return None
+    return {
+        item["id"]: item["statistics"]
+        for item in response.json().get("items", [])
+    }
+
+
+def journal_path(output_path):
+    return output_path + ".journal"
+
+
+def load_search_results(output_path):
+    """
+    Load the compacted search results, then replay the journal of responses
+    fetched since the last compaction. A partial last line (crash during a
+    write) is truncated away, so that the next append starts on a new line.
+    """
+    results = dict()
+    if os.path.isfile(output_path):
+        with codecs.open(output_path, "r", "utf8") as file:
+            results = json.load(file)
+    path = journal_path(output_path)
+    if os.path.isfile(path):
+        with open(path, "rb+") as file:
+            data = file.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                logging.warning("Truncating a partial journal line in %s", path)
+                file.truncate(end)
+        for line in data[:end].decode("utf8").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("Ignoring a corrupted journal line in %s", path)
+                continue
+            results[record["doc_id"]] = record["response"]
+    return results
+
+
+def append_to_journal(file, doc_id, response):
+    file.write(json.dumps({"doc_id": doc_id, "response": response}) + "\n")
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def compact_search_results(output_path, results):
+    tmp_path = output_path + ".tmp"
+    with codecs.open(tmp_path, "w", "utf8") as file:
+        json.dump(results, file)
+    os.replace(tmp_path, output_path)
+    if os.path.isfile(journal_path(output_path)):
+        os.remove(journal_path(output_path))
+
+
 def action_search(token_path, merger_path, output_path, delay):
     with open(token_path, "r") as file:
         token = json.load(file)
@@ -68,30 +140,81 @@ def action_search(token_path, merger_path, output_path, delay):
         "Found %d episodes where a YouTube video is missing",
         len(missing)
     )
-    results = dict()
-    if os.path.isfile(output_path):
-        with codecs.open(output_path, "r", "utf8") as file:
-            results = json.load(file)
-    for row in tqdm.tqdm(missing):
-        if row["links"]["youtube_id"] is not None:
-            continue
-        if results.get(str(row["doc_id"])) is not None:
-            continue
-        query = f'{row["title"]} {row["collection"]}'
-        search_results = search(token, query)
-        if search_results is None:
-            break
-        results[str(row["doc_id"])] = search_results
-        time.sleep(delay)
-    with codecs.open(output_path, "w", "utf8") as file:
-        json.dump(results, file)
+    results = load_search_results(output_path)
+    try:
+        with codecs.open(journal_path(output_path), "a", "utf8") as journal:
+            for row in tqdm.tqdm(missing):
+                if row["links"]["youtube_id"] is not None:
+                    continue
+                if results.get(str(row["doc_id"])) is not None:
+                    continue
+                query = f'{row["title"]} {row["collection"]}'
+                search_results = search(token, query)
+                if search_results is None:
+                    break
+                results[str(row["doc_id"])] = search_results
+                append_to_journal(journal, str(row["doc_id"]), search_results)
+                time.sleep(delay)
+    finally:
+        compact_search_results(output_path, results)
+
+
+class TitleMatcher:
+    """
+    Score candidate video titles against a reference title. The reference is
+    analysed once: its length and character counts give cheap upper bounds
+    on the SequenceMatcher ratio (the same bounds as `real_quick_ratio` and
+    `quick_ratio`), so only candidates that may reach the threshold get an
+    exact ratio. Ratios are identical to a plain SequenceMatcher(None, a, b).
+    """
+
+    def __init__(self, title, threshold):
+        self.title = title
+        self.threshold = threshold
+        self.length = len(title)
+        self.counts = collections.Counter(title)
+        self.matcher = difflib.SequenceMatcher(None, title)
+        self.cache = dict()
+
+    def _upper_bound(self, candidate):
+        total = self.length + len(candidate)
+        if total == 0:
+            return 1.
+        if 2. * min(self.length, len(candidate)) / total < self.threshold:
+            return 0.
+        overlap = sum((self.counts & collections.Counter(candidate)).values())
+        return 2. * overlap / total
+
+    def ratio(self, candidate):
+        """
+        Return the exact ratio, or None if the candidate cannot reach the
+        threshold.
+        """
+        if candidate not in self.cache:
+            if self._upper_bound(candidate) < self.threshold:
+                self.cache[candidate] = None
+            else:
+                self.matcher.set_seq2(candidate)
+                self.cache[candidate] = self.matcher.ratio()
+        return self.cache[candidate]
+
+
+ALIGNMENT_FIELDS = [
+    "doc_id",
+    "link",
+    "doc_title",
+    "video_title",
+    "match",
+    "collection",
+    "channel",
+    "description",
+]
 
 
 def action_align(merger_path, search_results_path, threshold, alignment_path):
     with codecs.open(merger_path, "r", "utf8") as file:
         merger = json.load(file)["entries"]
-    with codecs.open(search_results_path, "r", "utf8") as file:
-        search = json.load(file)
+    search = load_search_results(search_results_path)
     missing = dict()
     used = set()
     for row in merger:
@@ -99,30 +222,67 @@ def action_align(merger_path, search_results_path, threshold, alignment_path):
             missing[row["doc_id"]] = row
         else:
             used.add(row["links"]["youtube_id"])
-    alignments = list()
-    for doc_id, results in search.items():
-        if results is None:
-            continue
-        doc_id = int(doc_id)
-        for result in results["items"]:
-            if result["id"]["kind"] != "youtube#video":
-                continue
-            if result["id"]["videoId"] in used:
+    matchers = dict()
+    with codecs.open(alignment_path, "w", "utf8") as file:
+        writer = csv.DictWriter(file, fieldnames=ALIGNMENT_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        for doc_id, results in search.items():
+            if results is None:
                 continue
-            match = difflib.SequenceMatcher(None, missing[doc_id]["title"], result["snippet"]["title"]).ratio()
-            if match < threshold:
-                continue
-            alignments.append({
-                "doc_id": doc_id,
-                "link": "=LIEN.HYPERTEXTE(\"https://www.youtube.com/watch?v=" + result["id"]["videoId"] + "\";\"" + result["id"]["videoId"] + "\")",
-                "doc_title": missing[doc_id]["title"],
-                "video_title": result["snippet"]["title"],
-                "match": match,
-                "collection": missing[doc_id]["collection"],
-                "channel": result["snippet"]["channelTitle"],
-                "description": result["snippet"]["description"],
-            })
-    pandas.DataFrame(alignments).to_csv(alignment_path, index=False)
+            doc_id = int(doc_id)
+            doc = missing[doc_id]
+            if doc["title"] not in matchers:
+                matchers[doc["title"]] = TitleMatcher(doc["title"], threshold)
+            matcher = matchers[doc["title"]]
+            for result in results["items"]:
+                if result["id"]["kind"] != "youtube#video":
+                    continue
+                if result["id"]["videoId"] in used:
+                    continue
+                match = matcher.ratio(result["snippet"]["title"])
+                if match is None or match < threshold:
+                    continue
+                writer.writerow({
+                    "doc_id": doc_id,
+                    "link": "=LIEN.HYPERTEXTE(\"https://www.youtube.com/watch?v=%s\";\"%s\")" % (result["id"]["videoId"], result["id"]["videoId"]),
+                    "doc_title": doc["title"],
+                    "video_title": result["snippet"]["title"],
+                    "match": match,
+                    "collection": doc["collection"],
+                    "channel": result["snippet"]["channelTitle"],
+                    "description": result["snippet"]["description"],
+                })
+
+
+def action_refresh_stats(token_path, youtube_path, delay):
+    with open(token_path, "r") as file:
+        token = json.load(file)
+    token = refresh(token)
+    with codecs.open(youtube_path, "r", "utf8") as file:
+        rows = json.load(file)["entries"]
+    video_ids = [row["id"] for row in rows]
+    statistics = dict()
+    with requests.Session() as session:
+        for i in tqdm.tqdm(range(0, len(video_ids), VIDEOS_BATCH_SIZE)):
+            batch = fetch_statistics(session, token, video_ids[i:i+VIDEOS_BATCH_SIZE])
+            if batch is None:
+                break
+            statistics.update(batch)
+            time.sleep(delay)
+    updated = 0
+    for row in rows:
+        if row["id"] not in statistics:
+            continue
+        row.setdefault("stats", dict())
+        for field, key in [("view_count", "viewCount"), ("like_count", "likeCount")]:
+            if key in statistics[row["id"]]:
+                row["stats"][field] = int(statistics[row["id"]][key])
+        updated += 1
+    logging.info("Refreshed statistics of %d/%d videos", updated, len(rows))
+    tmp_path = youtube_path + ".tmp"
+    with codecs.open(tmp_path, "w", "utf8") as file:
+        json.dump({"entries": rows}, file, indent=4, sort_keys=True)
+    os.replace(tmp_path, youtube_path)
 
 
 def main():
@@ -133,12 +293,15 @@ def main():
     parser.add_argument("--delay", type=float, default=3)
     parser.add_argument("--threshold", type=float, default=.6)
     parser.add_argument("--alignment", type=str, default="youtube-alignment.csv")
-    parser.add_argument("action", choices=["search", "align"])
+    parser.add_argument("--youtube", type=str, default="data/youtube.json")
+    parser.add_argument("action", choices=["search", "align", "refresh-stats"])
     args = parser.parse_args()
     if args.action == "search":
         action_search(args.token, args.merger, args.search_results, args.delay)
     elif args.action == "align":
         action_align(args.merger, args.search_results, args.threshold, args.alignment)
+    elif args.action == "refresh-stats":
+        action_refresh_stats(args.token, args.youtube, args.delay)
 
 
 if __name__ == "__main__":
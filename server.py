@@ -0,0 +1,210 @@
+"""
+This module serves the query module over HTTP on localhost, so that other
+tools can filter the catalogue without loading merger.json themselves.
+
+    GET /query?collection=Faits divers&cast=Jean Topart&date_min=1970-01-01
+    GET /status
+
+List filters (cast, source, facets...) are repeated parameters. Responses
+carry an ETag derived from the dataset version and the normalized query,
+and conditional requests are answered with 304. merger.json is polled and
+the catalogue is rebuilt in the background when it changes.
+"""
+
+import argparse
+import functools
+import hashlib
+import http.server
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+import simplejson
+from query import Catalogue, LIST_FILTERS
+
+
+LIST_PARAMETERS = LIST_FILTERS + ["source", "opening", "facets"]
+INT_PARAMETERS = ["facets_bound", "duration_min", "duration_max", "cast_min", "cast_max"]
+STRING_PARAMETERS = ["collection", "author", "title", "pitch", "date_min", "date_max"]
+
+
+def parse_filters(query_string):
+    """
+    Turn a query string into a normalized, hashable tuple of filters, so
+    that equivalent queries share their cache entry. Raise ValueError on
+    unknown or malformed parameters.
+    """
+    filters = list()
+    for key, values in sorted(urllib.parse.parse_qs(query_string).items()):
+        values = [value.strip() for value in values if value.strip()]
+        if not values:
+            continue
+        if key in LIST_PARAMETERS:
+            filters.append((key, tuple(sorted(set(values)))))
+        elif key in INT_PARAMETERS:
+            filters.append((key, int(values[-1])))
+        elif key in STRING_PARAMETERS:
+            filters.append((key, values[-1]))
+        else:
+            raise ValueError("Unknown parameter %s" % key)
+    return tuple(filters)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class QueryService:
+    """
+    Hold the current catalogue and its cache of serialized responses. Both
+    are replaced together on reload, so a request never mixes versions.
+    """
+
+    def __init__(self, path_merger, cache_size):
+        self.path_merger = path_merger
+        self.cache_size = cache_size
+        self.signature = None
+        self.state = None
+        self.reload()
+        if self.state is None:
+            raise ValueError("Could not load %s" % path_merger)
+
+    def reload(self):
+        """Rebuild the catalogue if merger.json changed; return whether it did."""
+        signature = file_signature(self.path_merger)
+        if signature == self.signature:
+            return False
+        with open(self.path_merger, "rb") as file:
+            data = file.read()
+        try:
+            entries = simplejson.loads(data.decode("utf8"))["entries"]
+        except (ValueError, KeyError):
+            # merger.json is written in place, it may be caught mid-write:
+            # keep serving the previous version until the next poll.
+            logging.warning("Could not parse %s, keeping the previous version", self.path_merger)
+            return False
+        catalogue = Catalogue(entries)
+        version = hashlib.sha1(data).hexdigest()[:16]
+        respond = functools.lru_cache(maxsize=self.cache_size)(
+            functools.partial(self._respond, catalogue, version)
+        )
+        self.state = (catalogue, version, respond)
+        self.signature = signature
+        logging.info("Loaded %d entries from %s (version %s)", len(entries), self.path_merger, version)
+        return True
+
+    @staticmethod
+    def _respond(catalogue, version, filters):
+        entries = catalogue.query(dict(filters))
+        body = simplejson.dumps({
+            "version": version,
+            "count": len(entries),
+            "entries": entries,
+        }, sort_keys=True).encode("utf8")
+        etag = '"%s-%s"' % (version, hashlib.sha1(repr(filters).encode("utf8")).hexdigest()[:16])
+        return etag, body
+
+    def query(self, filters):
+        _, _, respond = self.state
+        return respond(filters)
+
+    def status(self):
+        catalogue, version, respond = self.state
+        info = respond.cache_info()
+        return {
+            "path": self.path_merger,
+            "version": version,
+            "entries": len(catalogue.entries),
+            "cache": {
+                "hits": info.hits,
+                "misses": info.misses,
+                "size": info.currsize,
+                "max_size": info.maxsize,
+            },
+        }
+
+    def watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except OSError as err:
+                logging.warning("Could not reload %s: %s", self.path_merger, err)
+
+
+class QueryRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    service = None
+
+    def send_body(self, status, body, etag=None, content_type="application/json; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_body(status, simplejson.dumps({"error": message}).encode("utf8"))
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/status":
+            self.send_body(200, simplejson.dumps(self.service.status(), indent=4).encode("utf8"))
+            return
+        if url.path != "/query":
+            self.send_error_json(404, "Unknown path %s" % url.path)
+            return
+        try:
+            filters = parse_filters(url.query)
+            etag, body = self.service.query(filters)
+        except (ValueError, re.error) as err:
+            self.send_error_json(400, str(err))
+            return
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_body(200, body, etag)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+def action_serve(path_merger, host, port, cache_size, interval):
+    service = QueryService(path_merger, cache_size)
+    threading.Thread(target=service.watch, args=(interval,), daemon=True).start()
+    QueryRequestHandler.service = service
+    server = http.server.ThreadingHTTPServer((host, port), QueryRequestHandler)
+    logging.info("Serving on http://%s:%d/", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--merger", type=str, default="data/merger.json")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-size", type=int, default=1024, help="Number of responses kept in memory")
+    parser.add_argument("--interval", type=float, default=2, help="Seconds between checks of merger.json")
+    args = parser.parse_args()
+    action_serve(args.merger, args.host, args.port, args.cache_size, args.interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,38 +1,56 @@
 import argparse
 import codecs
+import functools
+import hashlib
 import json
 import logging
 import re
+import shutil
 import subprocess
+import tempfile
+import multiprocessing
 import os
+import importlib.util
 import tqdm
-import fontTools.ttLib
-import eyed3
 
 
-INKSCAPE = r"C:\Program Files\Inkscape\bin\inkscape.exe"
+INKSCAPE = os.environ.get("INKSCAPE") or shutil.which("inkscape") or "inkscape"
+INKSCAPE_BATCH_SIZE = 100  # SVGs exported per Inkscape process
+TEMPLATE_VERSION = 1  # bump whenever generate_svg output changes
+COVER_FILENAME_PATTERN = re.compile(r"^([0-9a-f]{40}|\d{5})\.png$")
+
+FONT_FOLDERS = [
+    os.path.expanduser("~/.local/share/fonts"),
+    os.path.expanduser("~/.fonts"),
+    "/usr/local/share/fonts",
+    "/usr/share/fonts",
+    "/Library/Fonts",
+]
+if "WINDIR" in os.environ:
+    FONT_FOLDERS.append(os.path.join(os.environ["WINDIR"], "Fonts"))
 
 LOGO = """<path style="fill:yellow;fill-opacity:1;stroke:none;" d="m 432.24062,0.00287769 c -8.72578,-0.13895453 -25.78274,4.77296771 -36.87103,10.69409131 -3.56672,1.904615 1.47348,-5.3672325 -1.03219,-6.6066838 -6.10903,-3.0219487 -53.42652,11.3156478 -62.32845,21.2277378 -4.0871,4.550896 7.30025,-13.522964 2.62513,-12.973513 -11.81799,1.388899 -29.1197,13.985505 -38.53842,22.14413 -3.34931,2.901237 -0.87409,-6.362776 -3.64742,-4.995542 -13.83953,6.822917 -26.76963,19.734759 -38.89904,30.568727 -1.35811,1.213044 0.31017,-8.505828 -2.47791,-8.351813 -5.50357,0.304093 -17.37351,17.473062 -26.655,26.180264 -3.04298,2.854733 -0.96952,-5.798546 -4.05267,-2.984084 -16.09584,14.692425 -37.35187,40.060358 -47.7471,50.251478 -74.396263,17.9574 -92.08736,-11.41092 -112.052253,-42.824338 -9.235482,2.71161 -19.905765,66.398248 6.778718,110.054038 2.388433,3.9075 4.660648,11.50441 2.052794,16.18092 -5.344643,9.58421 -61.6692588,43.19971 -67.9244401,50.1605 -5.2240434,5.81333 4.8263248,12.19192 8.9324231,9.80748 4.106091,-2.38444 43.977522,-24.35084 54.745812,-26.50449 5.566292,-1.11327 8.895218,-0.26699 10.798303,-0.837 1.778538,-0.53261 2.169425,-2.51241 5.913592,-2.67477 5.190503,-0.22503 27.203011,28.34855 32.922591,19.45613 9.49745,-14.76598 23.18959,-59.20706 26.07936,-61.36407 1.87281,-1.3979 3.2991,-0.22778 3.4671,0.39039 1.48963,5.48148 -30.6307,71.71979 -23.61633,80.88475 8.07326,10.54841 28.90011,-13.58369 39.55739,-14.26048 4.32702,-0.27496 12.05913,18.40053 35.28803,18.13449 31.53999,-0.36119 86.50795,-48.64427 110.90591,-60.33025 50.00119,-23.94928 65.65004,-19.10203 85.82899,-15.47459 -8.35136,-81.57241 -90.53273,-76.75288 -103.41428,-83.93002 0.45019,-3.41432 1.01375,-6.53938 3.08005,-6.18984 7.55025,1.27717 24.4534,-4.17167 24.17377,-9.48987 -0.34401,-6.54251 -5.24465,-4.33894 -5.18412,-8.978734 0.0896,-6.860115 20.91748,-3.666562 34.94398,-9.620544 6.34139,-2.691799 0.84115,-7.962619 2.91462,-8.805056 4.78978,-1.946099 15.30625,-1.382384 26.10581,-7.20052 24.24166,-13.059833 35.12284,-8.308129 37.45495,-12.343281 1.4703,-2.544074 -4.80323,-4.332138 -3.55475,-6.022771 1.33919,-1.81348 20.69337,-0.507733 36.07376,-6.959019 7.0675,-2.964411 17.75487,-6.786416 26.12236,-7.853907 11.39081,-1.453248 23.86628,3.201219 23.29541,8.017669 -0.20358,1.718132 5.74618,2.051879 5.69359,0.473092 -0.2356,-7.073848 -3.92226,-35.613739 -64.325,-38.9006906 -3.08786,-0.1680514 2.3677,-6.3707559 1.10002,-7.19721997 -0.9506,-0.61971923 -2.52039,-0.92071693 -4.53406,-0.95279074 z M 415.83973,11.626604 c 1.72593,-0.172373 0.0407,5.788645 1.75173,5.634038 39.26101,-3.549051 70.87731,8.906706 69.98718,13.741043 -0.45755,2.485013 -5.98871,-0.579697 -18.25688,1.002422 -9.36428,1.20763 -21.72134,5.766894 -35.38728,9.0664 -14.08575,3.400855 -27.39277,5.559618 -44.90856,8.881143 -2.43799,0.462317 4.81796,6.108256 2.73431,6.735709 -8.36307,2.51831 -17.38266,5.090339 -25.93216,8.188054 -3.54668,1.285066 -9.71769,3.192894 -18.10634,5.508323 -9.0862,2.507967 -20.51002,2.006374 -25.1282,3.829364 -3.04833,1.203312 -0.16549,3.780763 1.94197,4.50591 2.63546,0.906837 8.15219,-1.451504 8.1682,3.693722 0.0128,3.459523 -18.44011,1.352708 -23.38973,4.737491 -0.29417,0.201246 -1.56988,1.538778 -1.78979,1.768288 -4.32632,4.514115 -32.53261,3.663666 -32.7522,9.680099 -0.17733,4.85367 15.3528,4.10075 24.27469,4.40004 5.02023,0.16844 5.91628,-0.19561 5.91855,1.84604 0.003,3.19255 -29.57775,2.53165 -31.87055,5.86892 -2.84718,4.14421 1.64524,4.30889 3.47703,6.46444 1.08267,1.27402 0.91189,3.05004 -2.1074,3.04363 -11.19347,-0.0224 -43.78466,1.55421 -48.35581,-0.0314 -2.14626,-0.74449 21.12393,-19.83322 48.38062,-36.349992 22.19706,-13.450766 47.66957,-25.245809 63.88006,-30.886316 56.53871,-19.67297 78.37727,-22.643444 108.41807,-24.835439 17.89646,-1.305875 29.98979,3.455499 29.98979,0.959407 0,-8.963934 -71.88881,-8.117828 -141.66159,17.077462 -46.21257,16.687606 -80.56529,37.430478 -106.34044,58.659538 -7.77136,6.40067 -16.97227,17.10655 -19.38172,17.10559 -9.29003,-0.004 -18.60563,2.5747 -20.03013,0.66993 -1.31114,-1.75318 11.29527,-14.46863 19.77209,-23.867762 0.95225,-1.055872 -0.22666,6.620592 2.32242,7.566092 0,0 0,-0.002 0,-0.002 2.81163,1.04295 15.68993,-23.921638 29.57126,-33.339428 1.23443,-0.837508 -1.45353,5.784554 2.19011,6.783672 3.51778,0.96459 25.56523,-26.445487 39.82537,-35.005163 1.68887,-1.013811 -2.32766,6.815011 1.36964,7.127746 6.63851,0.561478 27.79845,-21.09667 36.7354,-25.300257 2.17859,-1.024729 -7.96135,14.772104 -3.71356,15.034585 4.66531,0.288248 41.19914,-23.65818 60.34676,-26.850191 3.48539,-0.581042 -8.13049,13.763373 -4.48937,12.894115 13.9692,-3.335042 28.29698,-14.581303 42.54646,-16.005579 z M 119.82757,148.27444 c 15.70415,0.1678 28.66564,4.56927 27.89397,7.5264 0,0 -19.44813,-4.87079 -38.38957,-1.75009 -17.456163,2.87602 -36.576606,14.9039 -36.576606,14.9039 -1.011119,-1.67091 11.010207,-15.22744 30.859866,-19.22621 5.43733,-1.09536 10.97762,-1.50992 16.21234,-1.454 z m 128.49286,1.57476 c 2.64727,-0.005 5.09222,0.10829 7.32128,0.28284 26.66643,2.08816 28.36891,22.37128 23.82973,22.35256 0,0 -2.45023,-6.67544 -9.20042,-11.59726 -9.95498,-7.25857 -28.38302,-12.33634 -54.92279,0.10585 -21.68964,10.16827 -40.1502,20.08294 -48.93478,45.56693 -5.05623,14.66811 -0.85931,29.01386 10.09529,35.996 22.61732,14.41562 70.34612,-14.46225 70.34612,-14.46225 3.48411,3.76211 -20.67829,16.55533 -43.55713,23.36488 -19.00054,5.65524 -37.84233,1.37499 -42.50509,-13.54583 -3.80562,-12.178 -2.99088,-33.98022 7.97632,-48.15733 10.01721,-12.94908 22.99787,-22.40523 34.87118,-28.46962 17.93984,-9.16293 33.20875,-11.4143 44.68029,-11.43679 z m -16.32483,19.72246 c 15.95518,-0.11527 24.10619,5.75707 23.92732,8.80174 -0.24616,4.19174 -15.30347,9.90722 -26.84028,9.76445 -8.59773,-0.10646 -26.4296,-2.43431 -26.29273,-8.30714 0.13092,-5.61728 16.05027,-9.602 25.91063,-10.15485 1.13289,-0.0635 2.2314,-0.0965 3.29506,-0.10419 z m -119.36855,4.08244 c 1.38415,-0.0427 2.34327,0.18357 2.68303,0.81053 1.61534,2.98082 -9.71753,9.04178 -13.39532,11.82553 -3.663489,2.77295 -9.027738,5.00246 -13.208409,2.09747 -4.446491,-3.08974 -1.541272,-6.17944 1.159567,-8.35181 2.503528,-2.01371 8.194277,-3.28246 13.175322,-4.53735 3.78844,-0.95445 7.27889,-1.77328 9.58581,-1.84437 z m 16.21896,2.15867 c 0.65272,-0.0496 1.29654,3e-5 1.93039,0.16872 2.43813,0.6489 5.26208,0.005 6.7539,1.96182 4.35554,5.71263 -4.21765,9.20701 -7.45029,12.72374 -6.03254,6.56265 -29.39011,24.71839 -56.993809,44.63233 -3.47886,2.50963 -5.524439,-1.91821 -9.352577,-0.14392 -14.037966,6.50654 -29.075236,15.96713 -40.109884,20.80096 -38.981394,17.0762 5.301901,-10.84884 19.661259,-20.41554 12.453993,-8.2973 24.319701,-17.03667 36.750285,-26.61861 13.162575,-10.14615 26.932816,-19.09515 34.009366,-23.95212 5.21794,-3.58135 10.23234,-8.81025 14.80136,-9.15739 z" />"""
 
 
+@functools.lru_cache(maxsize=None)
 def load_svg(path):
     with open(path) as file:
         return file.read().replace("fill:#ffff00", "fill:#ffffff")
 
 
 FACETS = {
-    "Argent": load_svg("assets/argent.svg"),
-    "Arme à feu": load_svg("assets/arme-a-feu.svg"),
-    "Arme blanche": load_svg("assets/arme-blanche.svg"),
-    "Chantage": load_svg("assets/chantage.svg"),
-    "Drogue": load_svg("assets/drogue.svg"),
-    "Enlèvement": load_svg("assets/enlevement.svg"),
-    "Enquête": load_svg("assets/enquete.svg"),
-    "Justice": load_svg("assets/justice.svg"),
-    "Mariage": load_svg("assets/mariage.svg"),
-    "Meurtre": load_svg("assets/meurtre.svg"),
-    "Poison": load_svg("assets/poison.svg"),
-    "Vol": load_svg("assets/vol.svg"),
+    "Argent": "assets/argent.svg",
+    "Arme à feu": "assets/arme-a-feu.svg",
+    "Arme blanche": "assets/arme-blanche.svg",
+    "Chantage": "assets/chantage.svg",
+    "Drogue": "assets/drogue.svg",
+    "Enlèvement": "assets/enlevement.svg",
+    "Enquête": "assets/enquete.svg",
+    "Justice": "assets/justice.svg",
+    "Mariage": "assets/mariage.svg",
+    "Meurtre": "assets/meurtre.svg",
+    "Poison": "assets/poison.svg",
+    "Vol": "assets/vol.svg",
 }
 
 COLLECTIONS = {
@@ -57,28 +75,78 @@ ALBUM_ARTISTS = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def find_font(filename):
+    if os.path.isfile(filename):
+        return filename
+    for folder in FONT_FOLDERS:
+        for root, _, files in os.walk(folder):
+            if filename in files:
+                return os.path.join(root, filename)
+    raise FileNotFoundError("Font '%s' could not be found" % filename)
+
+
+@functools.lru_cache(maxsize=None)
+def load_advance_widths(path):
+    """
+    Parse a TTF once per process and return its advance widths (in font
+    units) as a list indexed by codepoint, along with its units per em.
+    """
+    import fontTools.ttLib
+    ttf = fontTools.ttLib.TTFont(find_font(path))
+    cmap = ttf["cmap"].getcmap(3, 1).cmap
+    metrics = ttf["hmtx"].metrics
+    widths = [None] * (max(cmap) + 1)
+    for codepoint, glyph_name in cmap.items():
+        widths[codepoint] = metrics[glyph_name][0]
+    return widths, ttf["head"].unitsPerEm
+
+
 class Font:
 
-    CMU_SERIF = r"C:\Windows\Fonts\cmunrm.ttf"
-    CMU_CONCRETE = r"C:\Windows\Fonts\cmunobi.ttf"
+    CMU_SERIF = "cmunrm.ttf"
+    CMU_CONCRETE = "cmunobi.ttf"
 
     def __init__(self, path, size):
-        ttf = fontTools.ttLib.TTFont(path)
-        self.glyph_set = ttf.getGlyphSet()
-        self.cmap = ttf["cmap"].getcmap(3, 1).cmap
-        self.coeff = size / ttf["head"].unitsPerEm
+        self.widths, units_per_em = load_advance_widths(path)
+        self.coeff = size / units_per_em
         self.size = size
+        self.word_widths = dict()
 
     def char_width(self, char):
-        return self.coeff * self.glyph_set[self.cmap[ord(char)]].width
+        codepoint = ord(char)
+        if codepoint >= len(self.widths) or self.widths[codepoint] is None:
+            raise KeyError(char)
+        return self.coeff * self.widths[codepoint]
 
     def word_width(self, word):
-        return sum([self.char_width(char) for char in word])
+        if word not in self.word_widths:
+            self.word_widths[word] = sum([self.char_width(char) for char in word])
+        return self.word_widths[word]
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(path, size):
+    return Font(path, size)
+
+
+def select_facets(doc):
+    """
+    Return the labels of the (at most four) best scoring facets that have
+    an icon, in display order.
+    """
+    labels = list()
+    for facet in sorted(doc["facets"], key=lambda x: -x["score"]):
+        if facet["label"] in FACETS:
+            labels.append(facet["label"])
+        if len(labels) == 4:
+            break
+    return labels
 
 
 def generate_svg(doc, padding=50, fig_size=600):
-    cmu_serif_80 = Font(Font.CMU_SERIF, 80)
-    cmu_concrete_1 = Font(Font.CMU_SERIF, 1)
+    cmu_serif_80 = get_font(Font.CMU_SERIF, 80)
+    cmu_concrete_1 = get_font(Font.CMU_SERIF, 1)
     lines = [""]
     space = cmu_serif_80.char_width(" ")
     target = fig_size - padding * 2
@@ -93,13 +161,7 @@ def generate_svg(doc, padding=50, fig_size=600):
     delim = "</tspan><tspan x=\"%d\" dy=\"1.2em\">" % padding
     fs = (target - padding - 500 * .25) / \
         cmu_concrete_1.word_width(doc["collection"])
-    facets = list()
-    if len(doc["facets"]) > 0:
-        for facet in sorted(doc["facets"], key=lambda x: -x["score"]):
-            if facet["label"] in FACETS:
-                facets.append(FACETS[facet["label"]])
-            if len(facets) == 4:
-                break
+    facets = [load_svg(FACETS[label]) for label in select_facets(doc)]
     facet_svg = ""
     if len(facets) == 4:
         scale = (target / 2 - padding) / 64
@@ -137,60 +199,209 @@ def generate_svg(doc, padding=50, fig_size=600):
     )).strip()
 
 
-def generate_png(doc, path):
-    with codecs.open("tmp.svg", "w", "utf8") as file:
-        file.write(generate_svg(doc))
-    process = subprocess.Popen(
-        [
-            INKSCAPE,
-            "tmp.svg",
-            "--export-type",
-            "png",
-            "--export-filename",
-            path,
-            "--actions",
-            "export-background:black"
-        ],
-    )
-    process.wait()
-    os.remove("tmp.svg")
+def write_atomic(path, data):
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def _render_albumart(job):
+    import cairosvg
+    doc, path = job
+    svg = generate_svg(doc).encode("utf8")
+    write_atomic(path, cairosvg.svg2png(bytestring=svg, background_color="black"))
+    return path
+
+
+def render_with_inkscape(jobs):
+    """
+    Export SVGs in batches, with a single Inkscape process per batch. Each
+    SVG gets a unique name in a private temporary folder.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        for start in tqdm.tqdm(range(0, len(jobs), INKSCAPE_BATCH_SIZE)):
+            batch = jobs[start:start+INKSCAPE_BATCH_SIZE]
+            svg_paths = list()
+            for i, (doc, _) in enumerate(batch):
+                svg_paths.append(os.path.join(folder, "%d.svg" % (start + i)))
+                with codecs.open(svg_paths[-1], "w", "utf8") as file:
+                    file.write(generate_svg(doc))
+            subprocess.run(
+                [
+                    INKSCAPE,
+                    "--export-type",
+                    "png",
+                    "--export-background",
+                    "black",
+                ] + svg_paths,
+                check=True
+            )
+            for svg_path, (_, path) in zip(svg_paths, batch):
+                shutil.move(svg_path[:-4] + ".png", path)
+
+
+def generate_pngs(jobs, workers=None):
+    """
+    Rasterize (doc, path) jobs. Rendering is done in-process by cairosvg
+    over a worker pool when available, otherwise by batched Inkscape runs.
+    """
+    if len(jobs) == 0:
+        return
+    if importlib.util.find_spec("cairosvg") is None:
+        logging.info("cairosvg is not installed, falling back to Inkscape")
+        render_with_inkscape(jobs)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        for _ in tqdm.tqdm(pool.imap_unordered(_render_albumart, jobs, chunksize=8), total=len(jobs)):
+            pass
 
 
-def action_tag(input_path):
+def cover_hash(doc):
+    """
+    Hash exactly what `generate_svg` renders: the title, the collection,
+    the facet icons (only drawn when there are four) and the template
+    version.
+    """
+    facets = select_facets(doc)
+    key = {
+        "title": doc["title"],
+        "collection": doc["collection"],
+        "facets": facets if len(facets) == 4 else [],
+        "template": TEMPLATE_VERSION,
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def update_covers(docs, folder, workers=None):
+    """
+    Render the covers whose inputs changed, store them by content hash,
+    write the doc ID to hash manifest and evict orphaned images. Return
+    the cover path of every document.
+    """
+    os.makedirs(folder, exist_ok=True)
+    hashes = {str(doc["doc_id"]): cover_hash(doc) for doc in docs}
+    jobs = dict()
+    for doc in docs:
+        digest = hashes[str(doc["doc_id"])]
+        path = os.path.join(folder, digest + ".png")
+        if digest not in jobs and not os.path.isfile(path):
+            jobs[digest] = (doc, path)
+    logging.info("Rendering %d album arts", len(jobs))
+    generate_pngs(list(jobs.values()), workers)
+    with codecs.open(os.path.join(folder, "manifest.json"), "w", "utf8") as file:
+        json.dump(hashes, file, indent=4, sort_keys=True)
+    referenced = set(digest + ".png" for digest in hashes.values())
+    evicted = 0
+    for filename in os.listdir(folder):
+        if COVER_FILENAME_PATTERN.match(filename) and filename not in referenced:
+            os.remove(os.path.join(folder, filename))
+            evicted += 1
+    logging.info("Evicted %d orphaned album arts", evicted)
+    return {
+        doc_id: os.path.join(folder, digest + ".png")
+        for doc_id, digest in hashes.items()
+    }
+
+
+def intended_tags(doc, track_num, albumart_path):
+    collection = COLLECTIONS[doc["collection"]]
+    return {
+        "title": doc["title"],
+        "album": doc["collection"],
+        "track_num": track_num,
+        "disc_num": [1, 1],
+        "genre": "Audio Theatre",
+        "recording_date": doc["diffusion_date"],
+        "artist": doc["credits"]["author"],
+        "album_artist": ALBUM_ARTISTS[collection],
+        "image": os.path.basename(albumart_path),
+    }
+
+
+def tags_fingerprint(tags):
+    return hashlib.sha1(json.dumps(tags, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _write_tags(job):
+    import eyed3
+    import eyed3.core
+    mp3_path, tags, albumart_path = job
+    audiofile = eyed3.load(mp3_path)
+    audiofile.tag.clear()
+    audiofile.tag.title = tags["title"]
+    audiofile.tag.album = tags["album"]
+    audiofile.tag.track_num = tags["track_num"]
+    audiofile.tag.disc_num = tuple(tags["disc_num"])
+    audiofile.tag.genre = tags["genre"]
+    audiofile.tag.recording_date = eyed3.core.Date.parse(tags["recording_date"])
+    audiofile.tag.artist = tags["artist"]
+    audiofile.tag.album_artist = tags["album_artist"]
+    with open(albumart_path, "rb") as file:
+        audiofile.tag.images.set(3, file.read(), "image/png")
+    audiofile.tag.save()
+    return mp3_path, tags_fingerprint(tags), file_signature(mp3_path)
+
+
+def load_tags_manifest(path):
+    if not os.path.isfile(path):
+        return dict()
+    with codecs.open(path, "r", "utf8") as file:
+        return json.load(file)
+
+
+def action_tag(input_path, albumarts_folder, mp3_folder, workers):
     with codecs.open(input_path, "r", "utf8") as file:
         docs = json.load(file)["entries"]
     docs.sort(key=lambda x: x["diffusion_date"])
+    covers = update_covers(
+        [doc for doc in docs if doc["links"]["youtube_id"] is not None],
+        albumarts_folder,
+        workers
+    )
+    manifest_path = os.path.join(mp3_folder, "tags.json")
+    manifest = load_tags_manifest(manifest_path)
     track_nums = dict()
-    for doc in tqdm.tqdm(docs):
+    jobs = list()
+    for doc in docs:
         if doc["links"]["youtube_id"] is None:
             continue
-        albumart_path = "data/albumarts/%05d.png" % doc["doc_id"]
-        if not os.path.isfile(albumart_path):
-            generate_png(doc, albumart_path)
-        mp3_path = "data/youtube/%s.mp3" % doc["links"]["youtube_id"]
-        audiofile = eyed3.load(mp3_path)
-        audiofile.tag.clear()
-        audiofile.tag.title = doc["title"]
-        audiofile.tag.album = doc["collection"]
+        albumart_path = covers[str(doc["doc_id"])]
+        mp3_path = os.path.join(mp3_folder, "%s.mp3" % doc["links"]["youtube_id"])
         track_nums.setdefault(COLLECTIONS[doc["collection"]], 0)
         track_nums[COLLECTIONS[doc["collection"]]] += 1
-        audiofile.tag.track_num = track_nums[COLLECTIONS[doc["collection"]]]
-        audiofile.tag.disc_num = (1, 1)
-        audiofile.tag.genre = "Audio Theatre"
-        audiofile.tag.recording_date = eyed3.core.Date.parse(
-            doc["diffusion_date"])
-        audiofile.tag.artist = doc["credits"]["author"]
-        audiofile.tag.album_artist = ALBUM_ARTISTS[COLLECTIONS[doc["collection"]]]
-        with open(albumart_path, "rb") as file:
-            audiofile.tag.images.set(3, file.read(), "image/png")
-        audiofile.tag.save()
+        tags = intended_tags(doc, track_nums[COLLECTIONS[doc["collection"]]], albumart_path)
+        previous = manifest.get(os.path.basename(mp3_path))
+        if previous is None or previous["fingerprint"] != tags_fingerprint(tags):
+            jobs.append((mp3_path, tags, albumart_path))
+        elif previous["signature"] != file_signature(mp3_path):
+            jobs.append((mp3_path, tags, albumart_path))
+    logging.info("Tagging %d changed MP3 files", len(jobs))
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for mp3_path, fingerprint, signature in tqdm.tqdm(pool.imap_unordered(_write_tags, jobs), total=len(jobs)):
+                manifest[os.path.basename(mp3_path)] = {
+                    "fingerprint": fingerprint,
+                    "signature": signature,
+                }
+    finally:
+        with codecs.open(manifest_path, "w", "utf8") as file:
+            json.dump(manifest, file, indent=4, sort_keys=True)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", type=str, default="data/merger.min.json")
+    parser.add_argument("--albumarts", type=str, default="data/albumarts")
+    parser.add_argument("--mp3", type=str, default="data/youtube")
+    parser.add_argument("--workers", type=int, default=None)
     args = parser.parse_args()
-    action_tag(args.input)
+    action_tag(args.input, args.albumarts, args.mp3, args.workers)
 
 
 if __name__ == "__main__":
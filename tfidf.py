@@ -1,4 +1,5 @@
 import codecs
+import numpy
 import simplejson
 import webvtt
 import os
@@ -13,10 +14,10 @@ PATTERN_TIMECODE = re.compile("(\d+):(\d+):(\d+)\.(\d+)")
 PATTERN_TOKENIZE = re.compile("[' \n]")
 
 
-def merge_captions(captions):
+def caption_increments(captions):
     """
-    Merge the text content of a list of webvtt.Caption into a single string,
-    where repetitions are pruned out.
+    Yield, for each webvtt.Caption of a list, the caption along with the text
+    it adds to the previous ones, where repetitions are pruned out.
     """
     text = ""
     for caption in captions:
@@ -25,9 +26,19 @@ def merge_captions(captions):
         for i in range(1, len(caption_text) + 1):
             if text.endswith(caption_text[:i]):
                 longest_prefix_length = i
+        increment = caption_text[longest_prefix_length:]
         if longest_prefix_length == 0:
-            text += " "
-        text += caption_text[longest_prefix_length:]
+            increment = " " + increment
+        text += increment
+        yield caption, increment
+
+
+def merge_captions(captions):
+    """
+    Merge the text content of a list of webvtt.Caption into a single string,
+    where repetitions are pruned out.
+    """
+    text = "".join(increment for _, increment in caption_increments(captions))
     return re.sub(" +", " ", text)
 
 
@@ -163,7 +174,106 @@ def compute_tfidf(tf, idf):
     return tfidf
 
 
-def action_relevant_words(youtube_path, stopwords_path, folder, top_n):
+def build_matrix(tfidf):
+    """
+    Store TF-IDF vectors as a row-normalized sparse matrix in CSR form. Rows
+    follow the order of the dict, columns index the sorted vocabulary; null
+    weights (words found in every transcript) are left out.
+    """
+    vocabulary = sorted(set(token for vector in tfidf.values() for token in vector))
+    column = {token: j for j, token in enumerate(vocabulary)}
+    indptr = [0]
+    indices = list()
+    data = list()
+    for vector in tfidf.values():
+        items = sorted((column[token], weight) for token, weight in vector.items() if weight > 0)
+        norm = math.sqrt(sum(weight * weight for _, weight in items)) or 1.
+        for j, weight in items:
+            indices.append(j)
+            data.append(weight / norm)
+        indptr.append(len(indices))
+    return {
+        "ids": numpy.array(list(tfidf)),
+        "vocabulary": numpy.array(vocabulary),
+        "indptr": numpy.array(indptr, dtype=numpy.int64),
+        "indices": numpy.array(indices, dtype=numpy.int64),
+        "data": numpy.array(data, dtype=numpy.float64),
+    }
+
+
+def transpose(matrix):
+    """Return the (indptr, rows, data) arrays of the CSC form of a CSR matrix."""
+    order = numpy.argsort(matrix["indices"], kind="stable")
+    rows = numpy.repeat(numpy.arange(len(matrix["indptr"]) - 1), numpy.diff(matrix["indptr"]))
+    counts = numpy.bincount(matrix["indices"], minlength=len(matrix["vocabulary"]))
+    indptr = numpy.concatenate([[0], numpy.cumsum(counts)])
+    return indptr, rows[order], matrix["data"][order]
+
+
+MAX_PRODUCTS = 1 << 21  # expanded (row, document) products held at once
+
+
+def accumulate_products(scores, rows, terms, weights, transposed, n):
+    """
+    Add to the flat block x n scores the products of the given non-zeros
+    (row, term, weight) with every document containing the term. Non-zeros
+    are expanded by chunks of at most MAX_PRODUCTS products, so that memory
+    does not grow with the document frequency of the terms.
+    """
+    col_indptr, col_rows, col_data = transposed
+    counts = col_indptr[terms + 1] - col_indptr[terms]
+    ends = numpy.cumsum(counts)
+    first = 0
+    while first < len(terms):
+        done = ends[first - 1] if first > 0 else 0
+        last = max(first + 1, int(numpy.searchsorted(ends, done + MAX_PRODUCTS, side="right")))
+        chunk = slice(first, last)
+        chunk_counts = counts[chunk]
+        offsets = numpy.repeat(col_indptr[terms[chunk]] - (ends[chunk] - chunk_counts - done), chunk_counts)
+        offsets += numpy.arange(offsets.size)
+        flat = numpy.repeat(rows[chunk], chunk_counts) * n + col_rows[offsets]
+        products = numpy.repeat(weights[chunk], chunk_counts) * col_data[offsets]
+        scores += numpy.bincount(flat, weights=products, minlength=scores.size)
+        first = last
+
+
+def nearest_neighbours(matrix, top_k, block_size):
+    """
+    Return, for every row, the indices and cosine similarities of its top_k
+    nearest rows. The product of the matrix with its transpose is computed
+    by blocks of rows, so that only a block_size x n dense block of scores
+    and a bounded number of products are held in memory at once.
+    """
+    n = len(matrix["indptr"]) - 1
+    top_k = min(top_k, n - 1)
+    transposed = transpose(matrix)
+    neighbours = list()
+    for a in tqdm.tqdm(range(0, n, block_size)):
+        b = min(a + block_size, n)
+        start, end = matrix["indptr"][a], matrix["indptr"][b]
+        rows = numpy.repeat(numpy.arange(b - a), numpy.diff(matrix["indptr"][a:b + 1]))
+        scores = numpy.zeros((b - a) * n)
+        accumulate_products(
+            scores,
+            rows,
+            matrix["indices"][start:end],
+            matrix["data"][start:end],
+            transposed,
+            n
+        )
+        scores = scores.reshape(b - a, n)
+        scores[numpy.arange(b - a), numpy.arange(a, b)] = -1
+        if top_k <= 0:
+            neighbours.extend([] for _ in range(a, b))
+            continue
+        best = numpy.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        for i in range(b - a):
+            order = best[i][numpy.argsort(-scores[i, best[i]], kind="stable")]
+            neighbours.append([(j, scores[i, j]) for j in order if scores[i, j] > 0])
+    return neighbours
+
+
+def action_relevant_words(youtube_path, stopwords_path, folder, top_n, matrix_path, top_k, block_size):
     with codecs.open(youtube_path, "r", "utf8") as file:
         rows = simplejson.load(file)["entries"]
     with codecs.open(stopwords_path, "r", "utf8") as file:
@@ -178,11 +288,25 @@ def action_relevant_words(youtube_path, stopwords_path, folder, top_n):
     tf = compute_tf(tokens)
     idf = compute_idf(tokens)
     tfidf = compute_tfidf(tf, idf)
+    matrix = build_matrix(tfidf)
+    numpy.savez_compressed(matrix_path, **matrix)
+    logging.info("Computing the %d nearest neighbours of %d transcripts", top_k, len(tfidf))
+    similar = dict()
+    for video_id, row_neighbours in zip(tfidf, nearest_neighbours(matrix, top_k, block_size)):
+        similar[video_id] = [
+            {
+                "id": str(matrix["ids"][j]),
+                "score": float(score)
+            }
+            for j, score in row_neighbours
+        ]
     logging.info("Exporting results to %s", youtube_path)
     for row in rows:
         if row["id"] not in tfidf:
             row["relevant_words"] = list()
+            row["similar"] = list()
             continue
+        row["similar"] = similar[row["id"]]
         row["relevant_words"] = [
             {
                 "label": word,
@@ -250,10 +374,13 @@ def main():
     parser.add_argument("--stopwords", type=str, default="data/stopwords.txt")
     parser.add_argument("--folder", type=str, default="data/youtube")
     parser.add_argument("--top-n", type=int, default=20)
+    parser.add_argument("--matrix", type=str, default="data/tfidf.npz", help="Where to save the normalized TF-IDF matrix")
+    parser.add_argument("--top-k", type=int, default=10, help="Number of similar episodes to keep")
+    parser.add_argument("--block-size", type=int, default=256, help="Rows per block of the similarity product")
     parser.add_argument("action", choices=["relevant_words", "chapters", "both"])
     args = parser.parse_args()
     if args.action in ["relevant_words", "both"]:
-        action_relevant_words(args.youtube, args.stopwords, args.folder, args.top_n)
+        action_relevant_words(args.youtube, args.stopwords, args.folder, args.top_n, args.matrix, args.top_k, args.block_size)
     if args.action in ["chapters", "both"]:
         action_chapters(args.youtube, args.stopwords, args.folder)
 
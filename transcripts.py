@@ -0,0 +1,270 @@
+"""
+This module builds a full-text index of the YouTube captions and answers
+phrase queries over it, with the time at which each hit is said.
+
+The index is a positional inverted index: for every term, the videos where
+it occurs and its positions in their caption text. Each video also stores
+the start time of the caption every position comes from. Postings and times
+are delta-encoded as variable-length integers in a single binary file,
+whose JSON header holds the term dictionary; posting lists are only decoded
+for the terms of a query.
+"""
+
+import argparse
+import bisect
+import codecs
+import functools
+import logging
+import os
+import re
+import struct
+import time
+import unicodedata
+import simplejson
+import tqdm
+
+
+INDEX_MAGIC = b"MPTX1"
+PATTERN_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize_query(query):
+    return PATTERN_WORD.findall(normalize_text(query))
+
+
+def encode_varints(values):
+    data = bytearray()
+    for value in values:
+        while value >= 0x80:
+            data.append((value & 0x7f) | 0x80)
+            value >>= 7
+        data.append(value)
+    return bytes(data)
+
+
+def decode_varints(data):
+    values = list()
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values
+
+
+def delta_encode(values):
+    previous = 0
+    gaps = list()
+    for value in values:
+        gaps.append(value - previous)
+        previous = value
+    return gaps
+
+
+def delta_decode(gaps):
+    values = list()
+    value = 0
+    for gap in gaps:
+        value += gap
+        values.append(value)
+    return values
+
+
+def timed_tokens(captions):
+    """
+    Return the normalized words of a list of webvtt.Caption, with repetitions
+    pruned out as in tfidf.merge_captions, along with the start time in
+    milliseconds of the caption each word begins in.
+    """
+    from tfidf import caption_increments, parse_timecode
+    offsets = list()
+    starts = list()
+    pieces = list()
+    length = 0
+    for caption, increment in caption_increments(captions):
+        offsets.append(length)
+        starts.append(int(1000 * parse_timecode(caption.start)))
+        pieces.append(increment)
+        length += len(increment)
+    text = normalize_text("".join(pieces))
+    tokens = list()
+    times = list()
+    for match in PATTERN_WORD.finditer(text):
+        tokens.append(match.group(0))
+        times.append(starts[bisect.bisect_right(offsets, match.start()) - 1])
+    return tokens, times
+
+
+def build_index(rows, folder):
+    """
+    Index the captions of the YouTube entries. Return the list of indexed
+    videos and the posting lists, as {term: {video position: [positions]}}.
+    """
+    import webvtt
+    videos = list()
+    postings = dict()
+    for row in tqdm.tqdm(rows):
+        path = os.path.join(folder, row["id"] + ".fr.vtt")
+        if not os.path.isfile(path):
+            continue
+        tokens, times = timed_tokens(webvtt.read(path))
+        doc = len(videos)
+        videos.append({"id": row["id"], "uri": row["uri"], "times": times})
+        for position, token in enumerate(tokens):
+            postings.setdefault(token, dict()).setdefault(doc, list()).append(position)
+    return videos, postings
+
+
+def write_index(videos, postings, path):
+    blob = bytearray()
+    header = {"videos": list(), "terms": dict()}
+    for video in videos:
+        data = encode_varints(delta_encode(video["times"]))
+        header["videos"].append({
+            "id": video["id"],
+            "uri": video["uri"],
+            "times": [len(blob), len(data)],
+        })
+        blob += data
+    for term in sorted(postings):
+        values = list()
+        previous = 0
+        for doc, positions in sorted(postings[term].items()):
+            values.append(doc - previous)
+            values.append(len(positions))
+            values.extend(delta_encode(positions))
+            previous = doc
+        data = encode_varints(values)
+        header["terms"][term] = [len(blob), len(data), len(postings[term])]
+        blob += data
+    header_bytes = simplejson.dumps(header, separators=(",", ":")).encode("utf8")
+    with open(path + ".tmp", "wb") as file:
+        file.write(INDEX_MAGIC)
+        file.write(struct.pack("<I", len(header_bytes)))
+        file.write(header_bytes)
+        file.write(blob)
+    os.replace(path + ".tmp", path)
+
+
+class TranscriptIndex:
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            if file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError("%s is not a transcript index" % path)
+            header_length, = struct.unpack("<I", file.read(4))
+            header = simplejson.loads(file.read(header_length).decode("utf8"))
+            self.blob = file.read()
+        self.videos = header["videos"]
+        self.terms = header["terms"]
+
+    def _slice(self, offset, length):
+        return self.blob[offset:offset + length]
+
+    @functools.lru_cache(maxsize=4096)
+    def postings(self, term):
+        """Return the positions of a term in every video, as {video position: [positions]}."""
+        if term not in self.terms:
+            return dict()
+        offset, length, _ = self.terms[term]
+        values = decode_varints(self._slice(offset, length))
+        result = dict()
+        doc = 0
+        i = 0
+        while i < len(values):
+            doc += values[i]
+            count = values[i + 1]
+            result[doc] = delta_decode(values[i + 2:i + 2 + count])
+            i += 2 + count
+        return result
+
+    @functools.lru_cache(maxsize=256)
+    def times(self, doc):
+        return delta_decode(decode_varints(self._slice(*self.videos[doc]["times"])))
+
+    def search(self, query):
+        """
+        Return the occurrences of a phrase, as (video, start time in seconds)
+        pairs, in index order.
+        """
+        terms = tokenize_query(query)
+        if not terms:
+            return list()
+        rarest = min(set(terms), key=lambda term: self.terms.get(term, [0, 0, 0])[2])
+        if rarest not in self.terms:
+            return list()
+        lists = [self.postings(term) for term in terms]
+        docs = set(self.postings(rarest))
+        for positions in lists:
+            docs.intersection_update(positions)
+        hits = list()
+        for doc in sorted(docs):
+            following = [set(positions[doc]) for positions in lists[1:]]
+            times = self.times(doc)
+            for start in lists[0][doc]:
+                if all(start + k + 1 in positions for k, positions in enumerate(following)):
+                    hits.append((self.videos[doc], times[start] / 1000))
+        return hits
+
+
+def action_build(youtube_path, folder, index_path):
+    with codecs.open(youtube_path, "r", "utf8") as file:
+        rows = simplejson.load(file)["entries"]
+    videos, postings = build_index(rows, folder)
+    write_index(videos, postings, index_path)
+    logging.info(
+        "Indexed %d words of %d videos (%d distinct terms) into %s (%.1f MB)",
+        sum(len(video["times"]) for video in videos),
+        len(videos),
+        len(postings),
+        index_path,
+        os.path.getsize(index_path) / 1e6
+    )
+
+
+def action_search(index_path, query, limit):
+    index = TranscriptIndex(index_path)
+    start = time.perf_counter()
+    hits = index.search(query)
+    logging.info("Found %d hits in %.1f ms", len(hits), 1000 * (time.perf_counter() - start))
+    for video, seconds in hits[:limit]:
+        print("%s\t%02d:%02d:%02d\t%s&t=%ds" % (
+            video["id"],
+            seconds // 3600,
+            seconds % 3600 // 60,
+            seconds % 60,
+            video["uri"],
+            seconds
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--youtube", type=str, default="data/youtube.json")
+    parser.add_argument("--folder", type=str, default="data/youtube")
+    parser.add_argument("--index", type=str, default="data/transcripts.index")
+    parser.add_argument("--query", type=str, help="Phrase to search for")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("action", choices=["build", "search"])
+    args = parser.parse_args()
+    if args.action == "build":
+        action_build(args.youtube, args.folder, args.index)
+    elif args.action == "search":
+        if not args.query:
+            parser.error("the search action requires --query")
+        action_search(args.index, args.query, args.limit)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
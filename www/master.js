@@ -1,4 +1,8 @@
-const DATASET_URL = "../data/merger.min.json";
+const DATASET_URL = "../data/merger.cards.json";
+const INDEX_URL = "../data/merger.index.json";
+const DETAILS_URL = "../data/merger/details/";
+const FULL_DATASET_URL = "../data/merger.min.json";
+const DETAILS_BLOCK_SIZE = 50; // must match DETAILS_BLOCK_SIZE in merge.py
 
 const OPENINGS = {
     "tempo_di_suspense": "&laquo;&nbsp;<i>Tempo di suspense</i>&nbsp;&raquo; par André Popp",
@@ -109,6 +113,163 @@ function requestDataset(callback) {
     request.send();
 }
 
+var filterIndex = {loaded: false, index: null, callbacks: []};
+
+function requestIndex() {
+    /* The index is optional: without it, filters scan the full dataset. */
+    let request = new XMLHttpRequest();
+    request.open("GET", INDEX_URL);
+    request.onreadystatechange = function () {
+        if (request.readyState == 4) {
+            if (request.status == "200") {
+                filterIndex.index = JSON.parse(request.responseText);
+            }
+            filterIndex.loaded = true;
+            filterIndex.callbacks.forEach(callback => { callback(filterIndex.index); });
+            filterIndex.callbacks = [];
+        }
+    };
+    request.send();
+}
+
+function whenIndexLoaded(callback) {
+    /* Call back with the filter index, or null if it could not be loaded. */
+    if (filterIndex.loaded) {
+        callback(filterIndex.index);
+    } else {
+        filterIndex.callbacks.push(callback);
+    }
+}
+
+var fullDataset = {entries: null, callbacks: null};
+
+function requestFullDataset(callback) {
+    /* Fetch the full records, at most once, for the scan fallback. Call back with null on failure. */
+    if (fullDataset.entries) {
+        callback(fullDataset.entries);
+        return;
+    }
+    if (fullDataset.callbacks) {
+        fullDataset.callbacks.push(callback);
+        return;
+    }
+    fullDataset.callbacks = [callback];
+    let request = new XMLHttpRequest();
+    request.open("GET", FULL_DATASET_URL);
+    request.onreadystatechange = function () {
+        if (request.readyState == 4) {
+            if (request.status == "200") {
+                fullDataset.entries = JSON.parse(request.responseText).entries;
+            } else {
+                console.error("Could not load " + FULL_DATASET_URL);
+            }
+            let callbacks = fullDataset.callbacks;
+            fullDataset.callbacks = null;
+            callbacks.forEach(pending => { pending(fullDataset.entries); });
+        }
+    };
+    request.send();
+}
+
+var detailBlocks = {};
+
+function requestDetails(docId, callback) {
+    /* Fetch the block holding the details of a document, at most once per block. Call back with null on failure. */
+    let blockId = Math.floor(docId / DETAILS_BLOCK_SIZE);
+    if (!(blockId in detailBlocks)) {
+        detailBlocks[blockId] = {details: null, callbacks: []};
+        let request = new XMLHttpRequest();
+        request.open("GET", DETAILS_URL + blockId + ".json");
+        request.onreadystatechange = function () {
+            if (request.readyState == 4) {
+                let block = detailBlocks[blockId];
+                if (request.status == "200") {
+                    block.details = JSON.parse(request.responseText);
+                } else {
+                    // Forget the block so that the next attempt fetches it again.
+                    delete detailBlocks[blockId];
+                }
+                block.callbacks.forEach(pending => {
+                    pending.callback(block.details ? block.details[pending.docId] || null : null);
+                });
+                block.callbacks = [];
+            }
+        };
+        request.send();
+    }
+    let block = detailBlocks[blockId];
+    if (block.details) {
+        callback(block.details[docId] || null);
+    } else {
+        block.callbacks.push({docId: docId, callback: callback});
+    }
+}
+
+function intersectPostings(candidates, postings) {
+    /* Intersect a set of doc IDs (null meaning every document) with a posting list. */
+    let result = new Set();
+    (postings || []).forEach(docId => {
+        if (candidates == null || candidates.has(docId)) {
+            result.add(docId);
+        }
+    });
+    return result;
+}
+
+function unionPostings(postingsList) {
+    let result = [];
+    postingsList.forEach(postings => {
+        (postings || []).forEach(docId => { result.push(docId); });
+    });
+    return result;
+}
+
+function facetPostings(index, label, minScore) {
+    /* Facet postings are sorted by decreasing score: keep the prefix above minScore. */
+    let facet = index.facets[label];
+    if (!facet) {
+        return [];
+    }
+    let end = 0;
+    while (end < facet.scores.length && facet.scores[end] >= minScore) {
+        end++;
+    }
+    return facet.doc_ids.slice(0, end);
+}
+
+function filterWithIndex(index, filters) {
+    /* Return the set of doc IDs matching the indexed filters, or null if none is set. */
+    let candidates = null;
+    filters.source.forEach(source => {
+        candidates = intersectPostings(candidates, index.source[source]);
+    });
+    if (filters.collection) {
+        candidates = intersectPostings(candidates, index.collection[normalize(filters.collection)]);
+    }
+    if (filters.author) {
+        candidates = intersectPostings(candidates, index.author[normalize(filters.author)]);
+    }
+    ["directors", "producers", "cast", "crew", "descriptors", "relevant_words"].forEach(field => {
+        if (filters[field]) {
+            candidates = intersectPostings(candidates, index[field][filters[field]]);
+        }
+    });
+    if (filters.opening.length) {
+        let keys = Object.keys(OPENINGS).filter(key => filters.opening.includes(OPENINGS[key]));
+        candidates = intersectPostings(candidates, unionPostings(keys.map(key => index.opening[key])));
+    }
+    if (filters.facets.length) {
+        let minScore = 3;
+        if (filters.facetsBound) {
+            minScore = filters.facetsBound;
+        }
+        filters.facets.forEach(label => {
+            candidates = intersectPostings(candidates, facetPostings(index, label, minScore));
+        });
+    }
+    return candidates;
+}
+
 function formatDuration(rawDuration) {
     let minutes = rawDuration / 60;
     return minutes.toFixed(0) + " min";
@@ -143,7 +304,81 @@ function checkArrayField(doc, filter, arrayGetter, fieldGetter) {
     return keep;
 }
 
-function loadDocData(doc, element) {
+function matchesIndexedFilters(doc, filters) {
+    /* Fallback for the filters covered by the index, when it could not be loaded. */
+    for (let k = 0; k < filters.source.length; k++) {
+        if (!doc.links[filters.source[k] + "_uri"]) return false;
+    }
+    if (filters.collection && normalize(doc.collection) != normalize(filters.collection)) return false;
+    if (filters.author && normalize(filters.author) != normalize(doc.credits.author)) return false;
+    if (filters.directors && !checkArrayField(doc, [filters.directors], doc => doc.credits.directors, item => item.name)) return false;
+    if (filters.producers && !checkArrayField(doc, [filters.producers], doc => doc.credits.producers, item => item.name)) return false;
+    if (filters.cast && !checkArrayField(doc, [filters.cast], doc => doc.credits.cast, item => item.name)) return false;
+    if (filters.crew && !checkArrayField(doc, [filters.crew], doc => doc.credits.crew, item => item.name)) return false;
+    if (filters.descriptors && !checkArrayField(doc, [filters.descriptors], doc => doc.descriptors, item => item.label)) return false;
+    if (filters.opening.length && !filters.opening.includes(OPENINGS[doc.opening])) return false;
+    if (filters.relevant_words && !checkArrayField(doc, [filters.relevant_words], doc => doc.relevant_words, item => item.label)) return false;
+    if (filters.facets.length) {
+        let minScore = 3;
+        if (filters.facetsBound) {
+            minScore = filters.facetsBound;
+        }
+        for (let k = 0; k < filters.facets.length; k++) {
+            let found = false;
+            for (let j = 0; j < doc.facets.length; j++) {
+                if (doc.facets[j].score >= minScore && doc.facets[j].label == filters.facets[k]) {
+                    found = true;
+                    break;
+                }
+            }
+            if (!found) return false;
+        }
+    }
+    return true;
+}
+
+function hasIndexedFilters(filters) {
+    return filters.source.length > 0
+        || filters.opening.length > 0
+        || filters.facets.length > 0
+        || ["collection", "author", "directors", "producers", "cast", "crew", "descriptors", "relevant_words"].some(field => filters[field]);
+}
+
+function selectCandidates(filters, callback) {
+    /* Call back with the set of doc IDs matching the indexed filters, null meaning every document. */
+    if (!hasIndexedFilters(filters)) {
+        callback(null);
+        return;
+    }
+    whenIndexLoaded(index => {
+        if (index) {
+            callback(filterWithIndex(index, filters));
+            return;
+        }
+        document.getElementById("modal-loading").classList.add("active");
+        requestFullDataset(entries => {
+            let candidates = new Set();
+            (entries || []).forEach(doc => {
+                if (matchesIndexedFilters(doc, filters)) {
+                    candidates.add(doc.doc_id);
+                }
+            });
+            callback(candidates);
+        });
+    });
+}
+
+function loadDocData(doc, callback) {
+    /* Render the details of a document, then call back with whether they could be loaded. */
+    requestDetails(doc.doc_id, details => {
+        if (details) {
+            renderDocData(doc, details);
+        }
+        callback(details != null);
+    });
+}
+
+function renderDocData(doc, details) {
 
     let minScore = 3;
     let filterFacetsBound = document.getElementById("input-facets-bound").value;
@@ -151,7 +386,7 @@ function loadDocData(doc, element) {
         minScore = parseInt(filterFacetsBound);
     }
 
-    element = document.getElementById("doc-" + doc.doc_id);
+    let element = document.getElementById("doc-" + doc.doc_id);
 
     if (doc.summary.pitch) {
         element.querySelector(".doc-pitch").textContent = doc.summary.pitch;
@@ -159,8 +394,8 @@ function loadDocData(doc, element) {
         element.querySelector(".doc-pitch").parentNode.remove();
     }
 
-    if (doc.chapters.length) {
-        doc.chapters.forEach(chapter => {
+    if (details.chapters.length) {
+        details.chapters.forEach(chapter => {
             let timelineItem = document.createElement("div");
             timelineItem.className = "timeline-item";
             timelineItem.innerHTML = '<div class="timeline-left"><a class="timeline-icon"></a></div>';
@@ -177,16 +412,16 @@ function loadDocData(doc, element) {
         element.querySelector(".doc-chapters").parentNode.remove();
     }
 
-    if (doc.credits.cast.length) {
+    if (details.credits.cast.length) {
         let castContainer = element.querySelector(".doc-cast");
-        doc.credits.cast.sort((a, b) => {
+        details.credits.cast.sort((a, b) => {
             if (a.name < b.name) {
                 return -1;
             } else {
                 return 1;
             }
         });
-        doc.credits.cast.forEach(person => {
+        details.credits.cast.forEach(person => {
             let chip = document.createElement("span");
             chip.className = "chip";
             if (person.character) {
@@ -196,25 +431,25 @@ function loadDocData(doc, element) {
             }
             castContainer.appendChild(chip);
         });
-        if (doc.credits.cast.length == 1) {
+        if (details.credits.cast.length == 1) {
             element.querySelector(".doc-cast-count").textContent = " (1)";
         } else {
-            element.querySelector(".doc-cast-count").textContent = "s (" + doc.credits.cast.length + ")";
+            element.querySelector(".doc-cast-count").textContent = "s (" + details.credits.cast.length + ")";
         }
     } else {
         element.querySelector(".doc-cast").parentNode.remove();
     }
 
-    if (doc.credits.directors.length) {
+    if (details.credits.directors.length) {
         let directorsContainer = element.querySelector(".doc-directors");
-        doc.credits.directors.sort((a, b) => {
+        details.credits.directors.sort((a, b) => {
             if (a.name < b.name) {
                 return -1;
             } else {
                 return 1;
             }
         });
-        doc.credits.directors.forEach(person => {
+        details.credits.directors.forEach(person => {
             let chip = document.createElement("span");
             chip.className = "chip";
             chip.textContent = person.name;
@@ -224,16 +459,16 @@ function loadDocData(doc, element) {
         element.querySelector(".doc-directors").parentNode.remove();
     }
 
-    if (doc.credits.crew.length) {
+    if (details.credits.crew.length) {
         let crewContainer = element.querySelector(".doc-crew");
-        doc.credits.crew.sort((a, b) => {
+        details.credits.crew.sort((a, b) => {
             if (a.name < b.name) {
                 return -1;
             } else {
                 return 1;
             }
         });
-        doc.credits.crew.forEach(person => {
+        details.credits.crew.forEach(person => {
             let chip = document.createElement("span");
             chip.className = "chip";
             chip.textContent = person.name + " (" + person.job + ")";
@@ -243,16 +478,16 @@ function loadDocData(doc, element) {
         element.querySelector(".doc-crew").parentNode.remove();
     }
 
-    if (doc.credits.producers.length) {
+    if (details.credits.producers.length) {
         let producersContainer = element.querySelector(".doc-producers");
-        doc.credits.producers.sort((a, b) => {
+        details.credits.producers.sort((a, b) => {
             if (a.name < b.name) {
                 return -1;
             } else {
                 return 1;
             }
         });
-        doc.credits.producers.forEach(person => {
+        details.credits.producers.forEach(person => {
             let chip = document.createElement("span");
             chip.className = "chip";
             chip.textContent = person.name;
@@ -262,9 +497,9 @@ function loadDocData(doc, element) {
         element.querySelector(".doc-producers").parentNode.remove();
     }
 
-    if (doc.descriptors.length) {
+    if (details.descriptors.length) {
         let descriptorsContainer = element.querySelector(".doc-descriptors");
-        doc.descriptors.forEach(descriptor => {
+        details.descriptors.forEach(descriptor => {
             let chip = document.createElement("span");
             chip.className = "chip";
             if (descriptor.specification) {
@@ -278,16 +513,16 @@ function loadDocData(doc, element) {
         element.querySelector(".doc-descriptors").remove();
     }
 
-    if (doc.opening) {
-        element.querySelector(".doc-opening").innerHTML = OPENINGS[doc.opening];
+    if (details.opening) {
+        element.querySelector(".doc-opening").innerHTML = OPENINGS[details.opening];
     } else {
         element.querySelector(".doc-opening").parentNode.remove();
     }
 
     let empty = true;
     let facetsContainer = element.querySelector(".doc-facets");
-    doc.facets.sort((a, b) => b.score - a.score);
-    doc.facets.forEach(facet => {
+    details.facets.sort((a, b) => b.score - a.score);
+    details.facets.forEach(facet => {
         if (facet.score >= minScore) {
             let chip = document.createElement("span");
             chip.className = "chip";
@@ -300,9 +535,9 @@ function loadDocData(doc, element) {
         facetsContainer.remove();
     }
 
-    if (doc.relevant_words.length) {
+    if (details.relevant_words.length) {
         let relevantWordsContainer = element.querySelector(".doc-relevant-words");
-        doc.relevant_words.forEach(word => {
+        details.relevant_words.forEach(word => {
             let chip = document.createElement("span");
             chip.className = "chip tooltip";
             chip.textContent = word.label;
@@ -389,9 +624,23 @@ function loadDataset(dataset) {
         var loaded = false;
         element.querySelector("details").addEventListener("toggle", (event) => {
             if (!loaded) {
-                loadDocData(doc);
                 loaded = true;
-                event.target.querySelector(".hide").classList.remove("hide");
+                let error = event.target.querySelector(".doc-error");
+                if (error) {
+                    error.remove();
+                }
+                loadDocData(doc, success => {
+                    if (success) {
+                        event.target.querySelector(".hide").classList.remove("hide");
+                    } else {
+                        // Let the next toggle try again.
+                        loaded = false;
+                        let message = document.createElement("p");
+                        message.className = "doc-error text-error my-2";
+                        message.textContent = "Impossible de charger le détail de cet épisode.";
+                        event.target.appendChild(message);
+                    }
+                });
             }
         });
 
@@ -426,8 +675,15 @@ function gatherLabels(dataset, getter) {
     return labels;
 }
 
-function populateSelect(dataset, getter, selectId) {
-    let labels = gatherLabels(dataset, getter);
+function indexLabels(postings) {
+    let labels = {};
+    Object.keys(postings).forEach(value => {
+        labels[value] = postings[value].length;
+    });
+    return labels;
+}
+
+function populateSelect(labels, selectId) {
     let select = document.getElementById(selectId);
     Object.keys(labels).sort().forEach(label => {
         let option = document.createElement("option");
@@ -464,45 +720,54 @@ function bindActionButtons() {
     });
 }
 
+function setupIndexedInputs(index) {
+    /* Fill the inputs whose options are not in the cards, from the filter index. */
+    autocomplete(document.getElementById("input-directors"), indexLabels(index.directors));
+    autocomplete(document.getElementById("input-producers"), indexLabels(index.producers));
+    autocomplete(document.getElementById("input-cast"), indexLabels(index.cast));
+    autocomplete(document.getElementById("input-crew"), indexLabels(index.crew));
+    autocomplete(document.getElementById("input-descriptors"), indexLabels(index.descriptors));
+    let openings = {};
+    Object.keys(index.opening).forEach(key => {
+        if (OPENINGS[key]) {
+            openings[OPENINGS[key]] = (openings[OPENINGS[key]] || 0) + index.opening[key].length;
+        }
+    });
+    populateSelect(openings, "input-opening");
+    let maxFacetScore = null;
+    Object.values(index.facets).forEach(facet => {
+        if (facet.scores.length && (!maxFacetScore || facet.scores[0] > maxFacetScore)) {
+            maxFacetScore = facet.scores[0];
+        }
+    });
+    document.getElementById("input-facets-bound").max = maxFacetScore;
+}
+
+function setupScannedInputs(dataset) {
+    /* Same as setupIndexedInputs, from the full records when the index is unavailable. */
+    setupAutocomplete(dataset, doc => doc.credits.directors.map(person => person.name), "input-directors");
+    setupAutocomplete(dataset, doc => doc.credits.producers.map(person => person.name), "input-producers");
+    setupAutocomplete(dataset, doc => doc.credits.cast.map(person => person.name), "input-cast");
+    setupAutocomplete(dataset, doc => doc.credits.crew.map(person => person.name), "input-crew");
+    setupAutocomplete(dataset, doc => doc.descriptors.map(item => item.label), "input-descriptors");
+    populateSelect(gatherLabels(dataset, doc => doc.opening ? [OPENINGS[doc.opening]] : []), "input-opening");
+    let maxFacetScore = null;
+    dataset.forEach(doc => {
+        doc.facets.forEach(facet => {
+            if (!maxFacetScore || facet.score > maxFacetScore) {
+                maxFacetScore = facet.score;
+            }
+        });
+    });
+    document.getElementById("input-facets-bound").max = maxFacetScore;
+}
+
 function setupForm(dataset) {
     setupAutocomplete(dataset, doc => [doc.credits.author], "input-author");
-    setupAutocomplete(dataset, doc => {
-        let values = [];
-        doc.credits.directors.forEach(person => { values.push(person.name); });
-        return values;
-    }, "input-directors");
-    setupAutocomplete(dataset, doc => {
-        let values = [];
-        doc.credits.producers.forEach(person => { values.push(person.name); });
-        return values;
-    }, "input-producers");
-    setupAutocomplete(dataset, doc => {
-        let values = [];
-        doc.credits.cast.forEach(person => { values.push(person.name); });
-        return values;
-    }, "input-cast");
-    setupAutocomplete(dataset, doc => {
-        let values = [];
-        doc.credits.crew.forEach(person => { values.push(person.name); });
-        return values;
-    }, "input-crew");
-    setupAutocomplete(dataset, doc => {
-        let values = [];
-        doc.descriptors.forEach(item => { values.push(item.label); });
-        return values;
-    }, "input-descriptors");
-    populateSelect(dataset, doc => {
-        if (doc.opening) {
-            return [OPENINGS[doc.opening]];
-        } else {
-            return [];
-        }
-    }, "input-opening");
     let minDiffusionDate = null;
     let maxDiffusionDate = null;
     let minDuration = null;
     let maxDuration = null;
-    let maxFacetScore = null;
     let minCastLength = null;
     let maxCastLength = null;
     dataset.forEach(doc => {
@@ -522,19 +787,12 @@ function setupForm(dataset) {
                 maxDuration = doc.duration;
             }
         }
-        if (doc.facets.length) {
-            doc.facets.forEach(facet => {
-                if (!maxFacetScore || facet.score > maxFacetScore) {
-                    maxFacetScore = facet.score;
-                }
-            });
-        }
-        if (doc.credits.cast.length) {
-            if (!minCastLength || doc.credits.cast.length < minCastLength) {
-                minCastLength = doc.credits.cast.length;
+        if (doc.cast_count) {
+            if (!minCastLength || doc.cast_count < minCastLength) {
+                minCastLength = doc.cast_count;
             }
-            if (!maxCastLength || doc.credits.cast.length > maxCastLength) {
-                maxCastLength = doc.credits.cast.length;
+            if (!maxCastLength || doc.cast_count > maxCastLength) {
+                maxCastLength = doc.cast_count;
             }
         }
     });
@@ -551,7 +809,6 @@ function setupForm(dataset) {
     document.getElementById("input-duration-max").max = Math.round(maxDuration / 60);
     document.getElementById("input-duration-max").placeholder = Math.round(maxDuration / 60);
     document.getElementById("input-facets-bound").min = 1;
-    document.getElementById("input-facets-bound").max = maxFacetScore;
     document.getElementById("input-facets-bound").placeholder = 3;
     document.getElementById("input-cast-min").min = minCastLength;
     document.getElementById("input-cast-min").max = maxCastLength;
@@ -625,90 +882,60 @@ function bindFormSubmit(dataset) {
         let filterOpening = readMultipleSelect("input-opening");
         let filterSource = readMultipleSelect("input-source");
 
-        for (let i = 0; i < dataset.length; i++) {
-            let doc = dataset[i];
-            if (filterSource.length) {
-                let keep = true;
-                filterSource.forEach(source => {
-                    if (!doc.links[source + "_uri"]) {
-                        keep = false;
-                    }
-                });
-                if (!keep) {
-                    continue;
-                }
-            }
-            if (filterTitle && !doc.title.match(filterTitle)) continue;
-            if (filterPitch && (!doc.summary.pitch || !doc.summary.pitch.match(filterPitch))) continue;
-            if (filterCollection && normalize(doc.collection) != normalize(filterCollection)) continue;
-            
-            // if (filterAuthors.length && !filterAuthors.includes(doc.credits.author)) continue;
-            if (filterAuthors && normalize(filterAuthors) != normalize(doc.credits.author)) continue;
-
-            // if (!checkArrayField(doc, filterDirectors, doc => doc.credits.directors, item => item.name)) continue;
-            if (filterDirectors && !checkArrayField(doc, [filterDirectors], doc => doc.credits.directors, item => item.name)) continue;
-            
-            // if (!checkArrayField(doc, filterProducers, doc => doc.credits.producers, item => item.name)) continue;
-            if (filterProducers && !checkArrayField(doc, [filterProducers], doc => doc.credits.producers, item => item.name)) continue;
-
-            // if (!checkArrayField(doc, filterCast, doc => doc.credits.cast, item => item.name)) continue;
-            if (filterCast && !checkArrayField(doc, [filterCast], doc => doc.credits.cast, item => item.name)) continue;
-
-            // if (!checkArrayField(doc, filterCrew, doc => doc.credits.crew, item => item.name)) continue;
-            if (filterCrew && !checkArrayField(doc, [filterCrew], doc => doc.credits.crew, item => item.name)) continue;
-            
-            // if (!checkArrayField(doc, filterDescriptors, doc => doc.descriptors, item => item.label)) continue;
-            if (filterDescriptors && !checkArrayField(doc, [filterDescriptors], doc => doc.descriptors, item => item.label)) continue;
-
-            if (filterCastMin && doc.credits.cast.length < filterCastMin) continue;
-            if (filterCastMax && doc.credits.cast.length > filterCastMax) continue;
-            if (filterDurationMin && (!doc.duration || Math.round(doc.duration / 60) < filterDurationMin)) continue;
-            if (filterDurationMax && (!doc.duration || Math.round(doc.duration / 60) > filterDurationMax)) continue;
-            if (filterDateMin && doc.diffusion_date < filterDateMin) continue;
-            if (filterDateMax && doc.diffusion_date > filterDateMax) continue;
-            if (filterOpening.length && !filterOpening.includes(OPENINGS[doc.opening])) continue;
-
-
-            if (filterRelevantWord && !checkArrayField(doc, [filterRelevantWord], doc => doc.relevant_words, item => item.label)) continue;
-
-            if (filterFacets.length) {
-                let minScore = 3;
-                if (filterFacetsBound) {
-                    minScore = filterFacetsBound;
-                }
-                let keep = true;
-                for (let k = 0; k < filterFacets.length; k++) {
-                    let found = false;
-                    for (let j = 0; j < doc.facets.length; j++) {
-                        if (doc.facets[j].score >= minScore && doc.facets[j].label == filterFacets[k]) {
-                            found = true;
-                            break;
-                        }
-                    }
-                    if (!found) {
-                        keep = false;
-                        break;
-                    }
-                }
-                if (!keep) {
-                    continue;
-                }
+        let indexedFilters = {
+            source: filterSource,
+            collection: filterCollection,
+            author: filterAuthors,
+            directors: filterDirectors,
+            producers: filterProducers,
+            cast: filterCast,
+            crew: filterCrew,
+            descriptors: filterDescriptors,
+            relevant_words: filterRelevantWord,
+            opening: filterOpening,
+            facets: filterFacets,
+            facetsBound: filterFacetsBound,
+        };
+        selectCandidates(indexedFilters, candidates => {
+            for (let i = 0; i < dataset.length; i++) {
+                let doc = dataset[i];
+                if (candidates && !candidates.has(doc.doc_id)) continue;
+                if (filterTitle && !doc.title.match(filterTitle)) continue;
+                if (filterPitch && (!doc.summary.pitch || !doc.summary.pitch.match(filterPitch))) continue;
+                if (filterCastMin && doc.cast_count < filterCastMin) continue;
+                if (filterCastMax && doc.cast_count > filterCastMax) continue;
+                if (filterDurationMin && (!doc.duration || Math.round(doc.duration / 60) < filterDurationMin)) continue;
+                if (filterDurationMax && (!doc.duration || Math.round(doc.duration / 60) > filterDurationMax)) continue;
+                if (filterDateMin && doc.diffusion_date < filterDateMin) continue;
+                if (filterDateMax && doc.diffusion_date > filterDateMax) continue;
+
+                newDataset.push(doc);
             }
 
-            newDataset.push(doc);
-        }
-
-        loadDataset(newDataset);
+            loadDataset(newDataset);
+        });
 
     });
 }
 
 function onLoad() {
+    requestIndex();
     requestDataset(dataset => {
         loadDataset(dataset);
         bindActionButtons();
         setupForm(dataset);
         bindFormSubmit(dataset);
+        whenIndexLoaded(index => {
+            if (index) {
+                setupIndexedInputs(index);
+            } else {
+                requestFullDataset(entries => {
+                    if (entries) {
+                        setupScannedInputs(entries);
+                    }
+                });
+            }
+        });
     });
 }
 